@@ -0,0 +1,213 @@
+import os
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import get_logger, metrics
+
+CLASS_NAMES = ['Very low', 'low', 'normal', 'high']
+CLASS_IDS = {name: class_id for class_id, name in enumerate(CLASS_NAMES)}
+
+INDEX_NAME = '.annotation_index.npz'
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.png')
+
+logger = get_logger(__name__)
+
+
+def _parse_coord(node, tag):
+    # 统一的坐标解析：兼容 "12" 与 "12.0" 两种写法
+    return int(float(node.find(tag).text.strip()))
+
+
+def parse_voc(xml_path):
+    """
+    解析一个 VOC XML，返回 (宽, 高, [(类别 id, xmin, ymin, xmax, ymax)])，所有阶段共用同一套规则：
+    坐标按 int(float()) 解析；未知类别、无法解析或宽高不为正的目标框跳过并记录警告；
+    XML 中缺少尺寸时宽高为 0
+    """
+    root = ET.parse(xml_path).getroot()
+    try:
+        width, height = _parse_coord(root, 'size/width'), _parse_coord(root, 'size/height')
+    except (ValueError, AttributeError):
+        width = height = 0
+
+    boxes = []
+    for obj in root.findall('object'):
+        class_id = CLASS_IDS.get(obj.find('name').text.strip())
+        if class_id is None:
+            continue
+        bndbox = obj.find('bndbox')
+        try:
+            xmin, ymin, xmax, ymax = (_parse_coord(bndbox, tag) for tag in ('xmin', 'ymin', 'xmax', 'ymax'))
+        except (ValueError, AttributeError) as e:
+            logger.warning("Error parsing bounding box in file %s: %s", xml_path, e)
+            continue
+        if xmax <= xmin or ymax <= ymin:
+            logger.warning("Invalid bounding box dimensions in file %s: %s", xml_path, (xmin, ymin, xmax, ymax))
+            continue
+        logger.debug("Parsed bbox: %s in file %s", (class_id, xmin, ymin, xmax, ymax), xml_path)
+        boxes.append((class_id, xmin, ymin, xmax, ymax))
+    return width, height, boxes
+
+
+def _parse_chunk(xml_dir, files):
+    """进程池任务：解析一批 XML，返回 [(文件名, 宽, 高, 目标框)]"""
+    return [(file, *parse_voc(os.path.join(xml_dir, file))) for file in files]
+
+
+class AnnotationIndex:
+    """
+    标注索引：每张图片一行（名称、图片文件名、宽、高，以及 XML 的大小与修改时间），
+    全部目标框存放在一个 (M, 6) int32 数组中 [图片 id, 类别 id, xmin, ymin, xmax, ymax]，按图片 id 排序
+    图片 id 为该图片在 names 中的下标；images 为同名图片文件名，找不到图片时为空字符串
+    """
+
+    def __init__(self, names, images, widths, heights, boxes, xml_sizes, xml_mtimes, source_dir=""):
+        self.names = np.asarray(names, dtype=str)
+        self.images = np.asarray(images, dtype=str)
+        self.widths = np.asarray(widths, dtype=np.int32)
+        self.heights = np.asarray(heights, dtype=np.int32)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 6)
+        self.xml_sizes = np.asarray(xml_sizes, dtype=np.int64)
+        self.xml_mtimes = np.asarray(xml_mtimes, dtype=np.int64)
+        self.source_dir = source_dir
+        self.offsets = np.searchsorted(self.boxes[:, 0], np.arange(len(self.names) + 1))
+
+    def __len__(self):
+        return len(self.names)
+
+    def boxes_for(self, image_id):
+        """某张图片的目标框视图 (K, 6)"""
+        return self.boxes[self.offsets[image_id]:self.offsets[image_id + 1]]
+
+    def image_path(self, image_id):
+        return os.path.join(self.source_dir, self.images[image_id]) if self.images[image_id] else None
+
+    def class_counts(self):
+        """返回 (每个类别的目标框数量, 包含该类别的图片数量)"""
+        box_counts = np.bincount(self.boxes[:, 1], minlength=len(CLASS_NAMES))
+        pairs = np.unique(self.boxes[:, :2], axis=0) if len(self.boxes) else np.zeros((0, 2), dtype=np.int32)
+        file_counts = np.bincount(pairs[:, 1], minlength=len(CLASS_NAMES))
+        return box_counts.tolist(), file_counts.tolist()
+
+    def dominant_classes(self):
+        """每张图片中数量最多的类别 id（数量相同时取较小的 id），没有目标框的图片为 -1"""
+        counts = np.zeros((len(self.names), len(CLASS_NAMES)), dtype=np.int64)
+        np.add.at(counts, (self.boxes[:, 0], self.boxes[:, 1]), 1)
+        return np.where(counts.any(axis=1), counts.argmax(axis=1), -1)
+
+    def save(self, index_path):
+        """原子写入 .npz"""
+        tmp_path = index_path + ".tmp.npz"
+        np.savez(tmp_path, version=INDEX_VERSION, names=self.names, images=self.images, widths=self.widths,
+                 heights=self.heights, boxes=self.boxes, xml_sizes=self.xml_sizes, xml_mtimes=self.xml_mtimes,
+                 source_dir=self.source_dir)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        """读取索引，文件不存在、损坏或版本不符时返回 None"""
+        try:
+            with np.load(index_path) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    return None
+                return cls(data["names"], data["images"], data["widths"], data["heights"], data["boxes"],
+                           data["xml_sizes"], data["xml_mtimes"], str(data["source_dir"]))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def build_annotation_index(xml_dir, index_path=None, num_workers=None, chunk_size=256):
+    """
+    遍历一次 xml_dir 建立（或增量更新）标注索引并保存，返回 AnnotationIndex
+    index_path: 默认 xml_dir/.annotation_index.npz；已有索引中 XML 大小与修改时间未变的图片直接沿用，只解析变化的文件
+    num_workers: 解析进程数，默认使用全部 CPU，为 1 时在当前进程串行执行
+    XML 中缺少图片尺寸时从图片文件头读取
+    """
+    index_path = index_path or os.path.join(xml_dir, INDEX_NAME)
+    previous = AnnotationIndex.load(index_path)
+    reuse = {}
+    if previous is not None and previous.source_dir == os.path.abspath(xml_dir):
+        reuse = {name: i for i, name in enumerate(previous.names)}
+
+    files = {}
+    names_on_disk = set()
+    with os.scandir(xml_dir) as entries:
+        for entry in entries:
+            names_on_disk.add(entry.name)
+            if entry.name.endswith('.xml'):
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+    parsed = {}
+    changed = []
+    for file, (size, mtime_ns) in files.items():
+        old = reuse.get(os.path.splitext(file)[0])
+        if old is not None and previous.xml_sizes[old] == size and previous.xml_mtimes[old] == mtime_ns:
+            boxes = previous.boxes_for(old)[:, 1:]
+            parsed[file] = (int(previous.widths[old]), int(previous.heights[old]), [tuple(box) for box in boxes])
+        else:
+            changed.append(file)
+
+    with metrics.stage("parse_xml"):
+        chunks = [changed[i:i + chunk_size] for i in range(0, len(changed), chunk_size)]
+        num_workers = num_workers or os.cpu_count() or 1
+        if num_workers == 1 or len(chunks) <= 1:
+            results = (_parse_chunk(xml_dir, chunk) for chunk in chunks)
+        else:
+            results = _parallel_parse(xml_dir, chunks, num_workers)
+        for chunk_results in results:
+            for file, width, height, boxes in chunk_results:
+                parsed[file] = (width, height, boxes)
+    metrics.count("xml_parsed", len(changed))
+    metrics.count("xml_reused", len(files) - len(changed))
+
+    names, images, widths, heights, xml_sizes, xml_mtimes, rows = [], [], [], [], [], [], []
+    for image_id, file in enumerate(sorted(files)):
+        name = os.path.splitext(file)[0]
+        image = next((name + ext for ext in IMAGE_EXTENSIONS if name + ext in names_on_disk), "")
+        width, height, boxes = parsed[file]
+        if (width <= 0 or height <= 0) and image:
+            with Image.open(os.path.join(xml_dir, image)) as img:
+                width, height = img.size
+        names.append(name)
+        images.append(image)
+        widths.append(width)
+        heights.append(height)
+        xml_sizes.append(files[file][0])
+        xml_mtimes.append(files[file][1])
+        rows.extend((image_id, *box) for box in boxes)
+
+    index = AnnotationIndex(names, images, widths, heights, rows, xml_sizes, xml_mtimes, os.path.abspath(xml_dir))
+    index.save(index_path)
+    return index
+
+
+def _parallel_parse(xml_dir, chunks, num_workers):
+    """多进程解析，同时在途的任务数限制为 2 * num_workers"""
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_chunk, xml_dir, chunk))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def print_statistics(index):
+    """打印各类别的目标框数量与图片数量"""
+    box_counts, file_counts = index.class_counts()
+    print(f"{len(index)} 个标注文件，{len(index.boxes)} 个目标框，{int((index.images != '').sum())} 张图片存在")
+    for name, boxes, files in zip(CLASS_NAMES, box_counts, file_counts):
+        print(f"  {name}: {boxes} 个目标框，{files} 个文件")
+
+
+if __name__ == "__main__":
+    mydatasets_dir = "../mydatasets"
+    index = build_annotation_index(mydatasets_dir)
+    print_statistics(index)
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image
+
+from annotation_index import CLASS_NAMES
+from convert_to_yolo_format import convert_xml_to_yolo
+from instrumentation import metrics
+
+VOC_TEMPLATE = """<annotation>
+    <filename>{filename}</filename>
+    <size>
+        <width>{width}</width>
+        <height>{height}</height>
+        <depth>3</depth>
+    </size>
+{objects}</annotation>
+"""
+
+OBJECT_TEMPLATE = """    <object>
+        <name>{name}</name>
+        <bndbox>
+            <xmin>{xmin}</xmin>
+            <ymin>{ymin}</ymin>
+            <xmax>{xmax}</xmax>
+            <ymax>{ymax}</ymax>
+        </bndbox>
+    </object>
+"""
+
+STAGES = ["parse_xml", "build_annotation_index", "check_and_fix_images", "create_classification_dataset",
+          "convert_xml_to_yolo", "split_dataset", "find_images_with_detections", "evaluate_dataset"]
+IMAGE_STAGES = {"check_and_fix_images", "create_classification_dataset", "split_dataset", "evaluate_dataset"}
+SERIAL_STAGES = {"convert_xml_to_yolo"}  # 额外以单进程运行一次，对比串行与多进程的吞吐量
+
+
+def random_boxes(rng, width, height, num_boxes):
+    """生成随机的 (类别名, xmin, ymin, xmax, ymax) 目标框"""
+    boxes = []
+    for _ in range(num_boxes):
+        w = rng.randint(width // 20, width // 6)
+        h = rng.randint(height // 20, height // 6)
+        xmin = rng.randint(0, width - w - 1)
+        ymin = rng.randint(0, height - h - 1)
+        boxes.append((rng.choice(CLASS_NAMES), xmin, ymin, xmin + w, ymin + h))
+    return boxes
+
+
+def write_voc_xml(xml_path, filename, width, height, boxes):
+    """按 labelImg 的 VOC 格式写入一个 XML 标注文件"""
+    objects = "".join(OBJECT_TEMPLATE.format(name=name, xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+                      for name, xmin, ymin, xmax, ymax in boxes)
+    with open(xml_path, 'w', encoding='utf-8') as f:
+        f.write(VOC_TEMPLATE.format(filename=filename, width=width, height=height, objects=objects))
+
+
+def synthetic_name(i):
+    """合成样本的文件名（不含扩展名），交替使用 ab / no 前缀，便于 evaluate_dataset 判定真实标签"""
+    return f"{'ab' if i % 2 else 'no'}_synthetic_{i:06d}"
+
+
+def generate_annotations(output_dir, num_files, boxes_per_file=8, width=1280, height=960, seed=0, images=False):
+    """生成 num_files 个合成的 VOC XML 标注文件；images 为 True 时同时生成同名的随机 JPEG 图片"""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    pixels = np.random.default_rng(seed)
+    for i in range(num_files):
+        base_name = synthetic_name(i)
+        boxes = random_boxes(rng, width, height, boxes_per_file)
+        write_voc_xml(os.path.join(output_dir, base_name + ".xml"), base_name + ".jpg", width, height, boxes)
+        if images:
+            noise = pixels.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+            Image.fromarray(noise).resize((width, height)).save(os.path.join(output_dir, base_name + ".jpg"))
+
+
+def generate_pred_log(log_path, num_files, seed=0):
+    """生成与 YOLOv8 控制台输出格式相同的预测日志，供 find_images_with_detections 解析"""
+    rng = random.Random(seed)
+    with open(log_path, 'w', encoding='utf-8') as f:
+        for _ in range(num_files):
+            lows, normals = rng.randint(0, 6), rng.randint(0, 6)
+            if lows == normals == 0:
+                f.write("0: 480x640 (no detections), 10.0ms\n")
+            else:
+                f.write(f"0: 480x640 {lows} lows, {normals} normals, 10.0ms\n")
+
+
+class StubModel:
+    """替代 YOLO 的桩模型：根据图片像素均值确定性地生成检测框，用于在没有权重的情况下测量评估流程本身的开销"""
+
+    def __call__(self, imgs, *args, **kwargs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        results = []
+        for img in imgs:
+            rng = np.random.default_rng(int(img[::16, ::16].mean() * 1000))
+            num_boxes = rng.integers(0, 9)
+            pred = np.zeros((num_boxes, 6), dtype=np.float32)
+            pred[:, 2:4] = 50
+            pred[:, 4] = rng.random(num_boxes)
+            pred[:, 5] = rng.integers(0, len(CLASS_NAMES), num_boxes)
+            results.append(pred)
+        return results
+
+
+def peak_rss_mb():
+    """当前进程及其子进程的峰值内存（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except (ImportError, AttributeError):
+            return None
+    scale = 1 if sys.platform == "darwin" else 1024  # Linux 下 ru_maxrss 单位为 KB，macOS 为字节
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage * scale / 2 ** 20
+
+
+def run_stage(stage, work_dir, num_workers):
+    """
+    在独立进程中执行一个阶段，返回 (处理的文件数, 耗时秒数, 峰值内存 MB, 各子阶段耗时)；各阶段的调试输出被丢弃
+    子阶段耗时来自 instrumentation.metrics，如 decode / inference / postprocess / file_io
+    """
+    from annotation_index import build_annotation_index
+    from classification_dataset import check_and_fix_images, create_classification_dataset, parse_xml
+    from end_for_testdatasets import evaluate_dataset
+    from get_best_datasets import find_images_with_detections
+    from split_dataset import split_dataset
+
+    dataset_dir = os.path.join(work_dir, "mydatasets")
+    label_dir = os.path.join(work_dir, "labels")
+    stage_dir = os.path.join(work_dir, stage)
+    shutil.rmtree(stage_dir, ignore_errors=True)
+    xml_files = [os.path.join(dataset_dir, f) for f in os.listdir(dataset_dir) if f.endswith(".xml")]
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        if stage == "parse_xml":
+            for xml_file in xml_files:
+                parse_xml(xml_file)
+            processed = len(xml_files)
+        elif stage == "build_annotation_index":
+            index_path = stage_dir + ".npz"
+            if os.path.exists(index_path):
+                os.remove(index_path)  # 测量完整建立索引，而不是增量更新
+            processed = len(build_annotation_index(dataset_dir, index_path, num_workers=num_workers))
+        elif stage == "check_and_fix_images":
+            processed = len(xml_files)
+            check_and_fix_images(dataset_dir, action="dry_run", cache_path=False, num_workers=num_workers)
+        elif stage == "create_classification_dataset":
+            processed = len(xml_files)
+            create_classification_dataset(dataset_dir, stage_dir, num_workers=num_workers)
+        elif stage == "convert_xml_to_yolo":
+            processed = convert_xml_to_yolo(stage_dir, dataset_dir, num_workers=num_workers).converted
+        elif stage == "split_dataset":
+            if not os.path.isdir(label_dir):
+                convert_xml_to_yolo(label_dir, dataset_dir, num_workers=num_workers)
+            start = time.perf_counter()
+            metrics.reset()  # 只统计划分本身，不含准备标签的转换
+            train_images, val_images = split_dataset(dataset_dir, label_dir, mode="hardlink", output_dir=stage_dir)
+            processed = len(train_images) + len(val_images)
+        elif stage == "find_images_with_detections":
+            find_images_with_detections(os.path.join(work_dir, "pred_out.txt"))
+            processed = len(xml_files)
+        elif stage == "evaluate_dataset":
+            evaluate_dataset("stub", dataset_dir, [0.57, 0.7, 0.8], batch_size=8, model=StubModel())
+            processed = len(xml_files)
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+    seconds = time.perf_counter() - start
+    breakdown = {name: round(stage["sum"], 4) for name, stage in metrics.to_dict()["stages"].items()}
+    return processed, seconds, peak_rss_mb(), breakdown
+
+
+def run_suite(work_dir, num_files, stages, num_workers):
+    """
+    生成合成数据集并依次测量各阶段，返回 {阶段: {"files", "seconds", "files_per_sec", "peak_rss_mb", "breakdown"}}
+    只有所选阶段需要图片（IMAGE_STAGES）时才生成 JPEG；SERIAL_STAGES 中的阶段另以单进程运行一次，
+    结果记为 "<阶段> (workers=1)"
+    """
+    dataset_dir = os.path.join(work_dir, "mydatasets")
+    images = any(stage in IMAGE_STAGES for stage in stages)
+    files = os.listdir(dataset_dir) if os.path.isdir(dataset_dir) else []
+    if (sum(f.endswith(".xml") for f in files) != num_files
+            or images and sum(f.endswith(".jpg") for f in files) != num_files):
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(work_dir, "labels"), ignore_errors=True)
+        start = time.perf_counter()
+        generate_annotations(dataset_dir, num_files, width=640, height=480, images=images)
+        generate_pred_log(os.path.join(work_dir, "pred_out.txt"), num_files)
+        what = "images and annotations" if images else "annotations"
+        print(f"Generated {num_files} synthetic {what} in {time.perf_counter() - start:.1f} s")
+
+    runs = []
+    for stage in stages:
+        if stage in SERIAL_STAGES and num_workers != 1:
+            runs.append((f"{stage} (workers=1)", stage, 1))
+        runs.append((stage, stage, num_workers))
+
+    results = {}
+    context = get_context("spawn")  # 每个阶段使用全新进程，峰值内存互不影响
+    for name, stage, workers in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            processed, seconds, rss, breakdown = executor.submit(run_stage, stage, work_dir, workers).result()
+        results[name] = {"files": processed, "seconds": seconds, "files_per_sec": processed / seconds,
+                         "peak_rss_mb": rss, "breakdown": breakdown}
+        rss_text = f"{rss:8.1f} MB" if rss is not None else "     n/a"
+        print(f"{name:<32} {processed:>8} files  {seconds:8.2f} s  {processed / seconds:10.1f} files/s  {rss_text}")
+        if breakdown:
+            print("    " + ", ".join(f"{name} {value:.2f} s" for name, value in breakdown.items()))
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    """与保存的基线对比：吞吐量下降或峰值内存上升超过 tolerance 视为回归，返回回归的阶段列表"""
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline.get(stage)
+        if previous is None:
+            continue
+        speed = current["files_per_sec"] / previous["files_per_sec"]
+        line = f"{stage:<32} throughput x{speed:5.2f}"
+        regressed = speed < 1 - tolerance
+        if current["peak_rss_mb"] and previous.get("peak_rss_mb"):
+            memory = current["peak_rss_mb"] / previous["peak_rss_mb"]
+            line += f"  peak RSS x{memory:5.2f}"
+            regressed |= memory > 1 + tolerance
+        print(line + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据处理流水线性能基准测试")
+    parser.add_argument("--files", type=int, default=2000, help="合成样本（图片 + 标注）数量")
+    parser.add_argument("--stages", default="all", help=f"逗号分隔的阶段列表，可选: {', '.join(STAGES)}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行进程数")
+    parser.add_argument("--work_dir", default=None, help="合成数据目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--baseline", default=None, help="与该基线 JSON 对比，出现回归时以非零状态退出")
+    parser.add_argument("--save_baseline", default=None, help="将本次结果保存为基线 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的性能波动比例")
+    args = parser.parse_args()
+
+    stages = STAGES if args.stages == "all" else args.stages.split(",")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="nail_bench_")
+    try:
+        results = run_suite(work_dir, args.files, stages, args.workers)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+
+
+def letterbox(img, new_size=640, color=(114, 114, 114)):
+    """
+    等比例缩放并填充到 new_size x new_size（与 Ultralytics LetterBox 的 auto=False 一致）
+    返回 (处理后的图片, 缩放比例, (左侧填充, 上侧填充))
+    """
+    height, width = img.shape[:2]
+    ratio = min(new_size / height, new_size / width)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    dw, dh = (new_size - new_w) / 2, (new_size - new_h) / 2
+    if (new_w, new_h) != (width, height):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, ratio, (left, top)
+
+
+def xywh_to_xyxy(boxes):
+    """中心点宽高格式转换为左上右下角坐标"""
+    xyxy = np.empty_like(boxes)
+    xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+    xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+    xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+    xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+    return xyxy
+
+
+def nms(pred, iou_threshold=0.5, metric="ios"):
+    """
+    按类别分别做非极大值抑制，pred 为 (N, 6) [x1, y1, x2, y2, conf, cls]
+    metric: "iou" 交并比；"ios" 交集占较小框面积的比例，能合并被分块边界截断的半个目标
+    """
+    if len(pred) == 0:
+        return pred
+    # 不同类别的框整体平移到互不重叠的位置，一次完成按类别的 NMS
+    offset = pred[:, 5:6] * (pred[:, :4].max() + 1)
+    boxes = pred[:, :4] + offset
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-pred[:, 4], kind='stable')
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        inter_h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = inter_w * inter_h
+        if metric == "ios":
+            overlap = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        else:
+            overlap = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return pred[keep]
+
+
+def box_iou(box, boxes):
+    """一个框与多个框 (M, 4) 的 IoU"""
+    inter_w = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    union = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def weighted_box_fusion(preds, weights=None, iou_threshold=0.55, skip_threshold=0.0, min_sources=1):
+    """
+    加权框融合（WBF）：合并多个模型 / 增强视图对同一张图片的检测结果 [(N, 6) ...]
+    同类别且 IoU 大于 iou_threshold 的框归为一簇，融合框坐标按置信度加权平均；
+    融合置信度为簇内平均置信度 * min(簇内框数, 来源数) / 权重之和，只被少数来源检出的框置信度相应降低
+    weights: 每个来源的权重，默认均为 1；置信度低于 skip_threshold 的框不参与融合
+    min_sources: 簇内至少来自多少个不同来源才保留，只被个别来源检出的框直接丢弃
+    """
+    weights = np.ones(len(preds)) if weights is None else np.asarray(weights, dtype=np.float64)
+    rows = [np.column_stack([pred[:, :4], pred[:, 4] * weight, pred[:, 5], np.full(len(pred), source)])
+            for source, (pred, weight) in enumerate(zip(preds, weights)) if len(pred)]
+    if not rows:
+        return np.zeros((0, 6), dtype=np.float32)
+    boxes = np.concatenate(rows).astype(np.float64)
+    boxes = boxes[(boxes[:, 4] >= skip_threshold) & (boxes[:, 4] > 0)]
+
+    fused = []
+    for class_id in np.unique(boxes[:, 5]):
+        members = boxes[boxes[:, 5] == class_id]
+        members = members[np.argsort(-members[:, 4], kind='stable')]
+        clusters = []
+        fused_boxes = np.zeros((0, 4))
+        for box in members:
+            if len(fused_boxes):
+                ious = box_iou(box[:4], fused_boxes)
+                best = int(np.argmax(ious))
+                if ious[best] > iou_threshold:
+                    clusters[best].append(box)
+                    cluster = np.array(clusters[best])
+                    fused_boxes[best] = (cluster[:, :4] * cluster[:, 4:5]).sum(axis=0) / cluster[:, 4].sum()
+                    continue
+            clusters.append([box])
+            fused_boxes = np.vstack([fused_boxes, box[:4]])
+
+        for cluster, fused_box in zip(clusters, fused_boxes):
+            cluster = np.array(cluster)
+            if len(np.unique(cluster[:, 6])) < min_sources:
+                continue
+            conf = cluster[:, 4].mean() * min(len(cluster), len(weights)) / weights.sum()
+            fused.append([*fused_box, conf, class_id])
+    fused = np.array(fused, dtype=np.float32).reshape(-1, 6)
+    return fused[np.argsort(-fused[:, 4], kind='stable')]
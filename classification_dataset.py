@@ -1,175 +1,319 @@
-import os
-import shutil
-import xml.etree.ElementTree as ET
-from PIL import Image
-import random
-from tqdm import tqdm
-from collections import defaultdict
-
-
-def check_and_fix_images(image_dir):
-    """
-    检查并删除损坏的 JPEG 图片
-    """
-    print("Checking and fixing train...")
-    for root, _, files in os.walk(image_dir):
-        for file in files:
-            if file.endswith(".jpg") or file.endswith(".jpeg"):
-                file_path = os.path.join(root, file)
-                try:
-                    with Image.open(file_path) as img:
-                        img.verify()  # 验证图片完整性
-                except (IOError, SyntaxError):
-                    print(f"Corrupted image found and removed: {file_path}")
-                    os.remove(file_path)  # 删除损坏的图片
-    print("Image check and fix completed.")
-
-
-def parse_xml(xml_file):
-    """
-    解析 XML 文件，获取边界框及其类别
-    """
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    objects = []
-
-    for obj in root.findall("object"):
-        name = obj.find("name").text.strip()
-        bndbox = obj.find("bndbox")
-
-        try:
-            bbox = {
-                "xmin": int(float(bndbox.find("xmin").text.strip())),
-                "ymin": int(float(bndbox.find("ymin").text.strip())),
-                "xmax": int(float(bndbox.find("xmax").text.strip())),
-                "ymax": int(float(bndbox.find("ymax").text.strip())),
-            }
-            print(f"Parsed bbox: {bbox} in file {xml_file}")  # 调试打印
-            objects.append({"name": name, "bbox": bbox})
-        except (ValueError, AttributeError) as e:
-            print(f"Error parsing bounding box in file {xml_file}: {e}")
-            continue
-
-    return objects
-
-
-def adjust_bbox(bbox, image_size, padding=0.1):
-    """
-    调整边界框，保留一定的背景区域，并验证数值合理性
-    """
-    try:
-        # 强制将 bbox 值转换为整数
-        xmin, ymin, xmax, ymax = (int(bbox[key]) for key in ["xmin", "ymin", "xmax", "ymax"])
-
-        width = xmax - xmin
-        height = ymax - ymin
-
-        if width <= 0 or height <= 0:
-            raise ValueError(f"Invalid bounding box dimensions: {bbox}")
-
-        pad_w = int(padding * width)
-        pad_h = int(padding * height)
-
-        xmin = max(0, xmin - pad_w)
-        ymin = max(0, ymin - pad_h)
-        xmax = min(image_size[0], xmax + pad_w)
-        ymax = min(image_size[1], ymax + pad_h)
-
-        return xmin, ymin, xmax, ymax
-    except Exception as e:
-        print(f"Error in adjust_bbox with bbox: {bbox}, image_size: {image_size}, error: {e}")
-        raise
-
-
-def clear_output_directory(output_dir):
-    """
-    清空输出目录
-    """
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)  # 删除整个目录
-    os.makedirs(output_dir)  # 重新创建空目录
-    print(f"Cleared and recreated directory: {output_dir}")
-
-
-def create_classification_dataset(mydatasets_dir, output_dir, split_ratio=0.9, padding=0.15):
-    """
-    创建分类数据集：裁剪图片并存储到分类目录中，并打印统计信息
-    """
-    # 定义类别
-    categories = ["Very low", "low", "normal", "high"]
-    for split in ["train", "val"]:
-        for category in categories:
-            path = os.path.join(output_dir, split, category)
-            os.makedirs(path, exist_ok=True)
-            print(f"Created directory: {path}")
-
-    # 获取所有图片和对应的标注
-    all_data = defaultdict(list)
-    for file in os.listdir(mydatasets_dir):
-        if file.endswith(".xml"):
-            base_name = os.path.splitext(file)[0]
-            image_file = os.path.join(mydatasets_dir, base_name + ".jpg")
-            xml_file = os.path.join(mydatasets_dir, file)
-            if os.path.exists(image_file):
-                objects = parse_xml(xml_file)
-                for obj in objects:
-                    all_data[obj["name"]].append({"image": image_file, "bbox": obj["bbox"]})
-
-    # 打印总分类统计信息
-    print("\nTotal train per category:")
-    for category in categories:
-        print(f"  {category}: {len(all_data[category])} train")
-
-    # 随机打乱数据并按比例划分
-    train_data = defaultdict(list)
-    val_data = defaultdict(list)
-    for category in categories:
-        data = all_data[category]
-        random.shuffle(data)
-        split_index = int(len(data) * split_ratio)
-        train_data[category] = data[:split_index]
-        val_data[category] = data[split_index:]
-
-    # 裁剪并保存图片
-    for split, data_dict in [("train", train_data), ("val", val_data)]:
-        for category, items in data_dict.items():
-            for item in tqdm(items, desc=f"Processing {split} data for {category}"):
-                print(f"Processing item: {item}")  # 调试打印
-                img = Image.open(item["image"])
-                image_size = img.size
-
-                # 打印 bbox 值和类型
-                print(
-                    f"Before adjust_bbox: {item['bbox']} ({type(item['bbox']['xmin'])}, {type(item['bbox']['ymin'])}, {type(item['bbox']['xmax'])}, {type(item['bbox']['ymax'])})")
-
-                bbox = adjust_bbox(item["bbox"], image_size, padding=padding)
-                cropped = img.crop(bbox)
-
-                # 保存到对应类别文件夹
-                save_dir = os.path.join(output_dir, split, category)
-                save_path = os.path.join(save_dir, f"{os.path.basename(item['image'])}_{category}.jpg")
-                cropped.save(save_path)
-
-    # 打印训练集和验证集统计信息
-    print("\nDataset split statistics:")
-    for category in categories:
-        print(f"  {category}:")
-        print(f"    Train: {len(train_data[category])} train")
-        print(f"    Val:   {len(val_data[category])} train")
-
-    print("Classification dataset created successfully.")
-
-
-if __name__ == "__main__":
-    # 输入和输出路径
-    mydatasets_dir = "../mydatasets"
-    output_dir = "classification_dataset"
-
-    # 清空输出目录
-    clear_output_directory(output_dir)
-
-    # 检查并修复损坏的图片
-    check_and_fix_images(mydatasets_dir)
-
-    # 创建分类数据集
-    create_classification_dataset(mydatasets_dir, output_dir, split_ratio=0.9, padding=0.15)
+import os
+import shutil
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from annotation_index import CLASS_NAMES, build_annotation_index, parse_voc
+from file_utils import load_json, save_json
+from hash_split import hash_split
+from instrumentation import get_logger, metrics
+from packed_crops import PackedCropWriter
+
+logger = get_logger(__name__)
+
+
+VERIFIED_CACHE_NAME = ".verified_images.json"
+
+
+def _verify_image(file_path):
+    """线程池任务：验证图片完整性，返回是否完好"""
+    try:
+        with Image.open(file_path) as img:
+            img.verify()  # 验证图片完整性
+        return True
+    except (IOError, SyntaxError):
+        return False
+
+
+def _iter_unverified(image_dir, verified, seen):
+    """遍历目录，产出 (路径, 大小, 修改时间)，跳过缓存中大小和修改时间都未变化的已验证图片"""
+    for root, _, files in os.walk(image_dir):
+        for file in files:
+            if file.endswith(".jpg") or file.endswith(".jpeg"):
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                seen.add(os.path.abspath(file_path))
+                if verified.get(os.path.abspath(file_path)) == [stat.st_size, stat.st_mtime_ns]:
+                    continue
+                yield file_path, stat.st_size, stat.st_mtime_ns
+
+
+def check_and_fix_images(image_dir, action="delete", quarantine_dir=None, cache_path=None, num_workers=8):
+    """
+    检查并处理损坏的 JPEG 图片，返回损坏图片的路径列表
+    action: "delete" 删除损坏图片；"quarantine" 移动到 quarantine_dir（默认 <image_dir>_quarantine）；
+            "dry_run" 只报告不做修改
+    cache_path: 已验证图片缓存（路径 -> 大小, 修改时间），默认 <image_dir>/.verified_images.json，
+                重复运行时只验证新增或变化的图片；设为 False 则不使用缓存
+    num_workers: 验证线程数
+    """
+    print("Checking and fixing train...")
+    if cache_path is None:
+        cache_path = os.path.join(image_dir, VERIFIED_CACHE_NAME)
+    verified = load_json(cache_path, {}) if cache_path else {}
+    if action == "quarantine":
+        quarantine_dir = quarantine_dir or os.path.normpath(image_dir) + "_quarantine"
+
+    corrupted = []
+    checked = 0
+    seen = set()
+
+    def handle(file_path, size, mtime_ns, ok):
+        if ok:
+            verified[os.path.abspath(file_path)] = [size, mtime_ns]
+            return
+        corrupted.append(file_path)
+        verified.pop(os.path.abspath(file_path), None)
+        if action == "delete":
+            print(f"Corrupted image found and removed: {file_path}")
+            os.remove(file_path)  # 删除损坏的图片
+        elif action == "quarantine":
+            target = os.path.join(quarantine_dir, os.path.relpath(file_path, image_dir))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(file_path, target)
+            print(f"Corrupted image found and quarantined: {file_path} -> {target}")
+        else:
+            print(f"Corrupted image found: {file_path}")
+
+    with metrics.stage("verify"), ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for file_path, size, mtime_ns in _iter_unverified(image_dir, verified, seen):
+            pending.append((file_path, size, mtime_ns, executor.submit(_verify_image, file_path)))
+            if len(pending) >= 4 * num_workers:
+                file_path, size, mtime_ns, future = pending.popleft()
+                handle(file_path, size, mtime_ns, future.result())
+                checked += 1
+        while pending:
+            file_path, size, mtime_ns, future = pending.popleft()
+            handle(file_path, size, mtime_ns, future.result())
+            checked += 1
+
+    if cache_path:
+        # 清理该目录下已不存在的文件记录
+        prefix = os.path.join(os.path.abspath(image_dir), "")
+        for path in [path for path in verified if path.startswith(prefix) and path not in seen]:
+            del verified[path]
+        save_json(cache_path, verified)
+    metrics.count("images_verified", checked)
+    metrics.count("images_corrupted", len(corrupted))
+    print(f"Image check and fix completed. Verified {checked} new or changed images, {len(corrupted)} corrupted.")
+    return corrupted
+
+
+def _bbox_dict(xmin, ymin, xmax, ymax):
+    return {"xmin": int(xmin), "ymin": int(ymin), "xmax": int(xmax), "ymax": int(ymax)}
+
+
+def parse_xml(xml_file):
+    """
+    解析 XML 文件，获取边界框及其类别；解析规则与 YOLO 标签转换相同（见 annotation_index.parse_voc）
+    """
+    _, _, boxes = parse_voc(xml_file)
+    return [{"name": CLASS_NAMES[class_id], "bbox": _bbox_dict(*bbox)} for class_id, *bbox in boxes]
+
+
+def adjust_bbox(bbox, image_size, padding=0.1):
+    """
+    调整边界框，保留一定的背景区域，并验证数值合理性
+    """
+    try:
+        # 强制将 bbox 值转换为整数
+        xmin, ymin, xmax, ymax = (int(bbox[key]) for key in ["xmin", "ymin", "xmax", "ymax"])
+
+        width = xmax - xmin
+        height = ymax - ymin
+
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Invalid bounding box dimensions: {bbox}")
+
+        pad_w = int(padding * width)
+        pad_h = int(padding * height)
+
+        xmin = max(0, xmin - pad_w)
+        ymin = max(0, ymin - pad_h)
+        xmax = min(image_size[0], xmax + pad_w)
+        ymax = min(image_size[1], ymax + pad_h)
+
+        return xmin, ymin, xmax, ymax
+    except Exception as e:
+        print(f"Error in adjust_bbox with bbox: {bbox}, image_size: {image_size}, error: {e}")
+        raise
+
+
+def clear_output_directory(output_dir):
+    """
+    清空输出目录
+    """
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)  # 删除整个目录
+    os.makedirs(output_dir)  # 重新创建空目录
+    print(f"Cleared and recreated directory: {output_dir}")
+
+
+def _item_key(item):
+    """划分用的目标标识：原图文件名 + 边界框坐标"""
+    bbox = item["bbox"]
+    return f"{os.path.basename(item['image'])}:{bbox['xmin']},{bbox['ymin']},{bbox['xmax']},{bbox['ymax']}"
+
+
+def _crop_image(image_path, crops, padding):
+    """
+    进程池任务：解码一张原图，依次裁剪并保存它的所有目标
+    crops: [(保存路径, bbox)]
+    """
+    with Image.open(image_path) as img:
+        image_size = img.size
+        for save_path, bbox in crops:
+            cropped = img.crop(adjust_bbox(bbox, image_size, padding=padding))
+            cropped.save(save_path)
+    return len(crops)
+
+
+def _crop_image_packed(image_path, crops, padding, crop_size):
+    """
+    进程池任务：解码一张原图，裁剪它的所有目标并缩放为 crop_size x crop_size 的 RGB uint8 数组
+    返回 [(保存路径, 数组)]，由主进程写入分片
+    """
+    with Image.open(image_path) as img:
+        image_size = img.size
+        img = img.convert("RGB")
+        return [(save_path, np.asarray(img.crop(adjust_bbox(bbox, image_size, padding=padding))
+                                       .resize((crop_size, crop_size), Image.BILINEAR)))
+                for save_path, bbox in crops]
+
+
+def create_classification_dataset(mydatasets_dir, output_dir, split_ratio=0.9, padding=0.15, seed=None,
+                                  num_workers=None, max_in_flight=None, index=None, output_format="jpeg",
+                                  crop_size=224, shard_size=4096):
+    """
+    创建分类数据集：裁剪图片并存储到分类目录中，并打印统计信息
+    index: 标注索引（annotation_index.AnnotationIndex），默认在 mydatasets_dir 中建立或增量更新，
+           目标框与 YOLO 标签转换使用的完全一致
+    seed: 划分用的哈希盐值；划分由每个目标（原图文件名 + 坐标）的稳定哈希决定，
+          相同输入总是得到相同划分，新增图片不会改变已有目标的划分
+    num_workers: 裁剪进程数，默认使用全部 CPU，为 1 时在当前进程串行执行
+    max_in_flight: 同时提交给进程池的图片数上限，默认 4 * num_workers
+    output_format: "jpeg" 每个裁剪图保存为 <split>/<类别>/ 下的单独 JPEG；
+                   "packed" 缩放为 crop_size 正方形后写入 <split>/shard_*.npy 分片（每片 shard_size 张）与 index.npz，
+                   避免大量小文件，训练时用 packed_crops.PackedCropDataset 以内存映射方式读取
+    """
+    if output_format not in ("jpeg", "packed"):
+        raise ValueError(f"Unknown output format: {output_format}, expected 'jpeg' or 'packed'")
+
+    # 定义类别
+    categories = ["Very low", "low", "normal", "high"]
+    for split in ["train", "val"] if output_format == "jpeg" else []:
+        for category in categories:
+            path = os.path.join(output_dir, split, category)
+            os.makedirs(path, exist_ok=True)
+            logger.debug("Created directory: %s", path)
+
+    # 从标注索引获取所有图片和对应的标注（只有 .jpg 图片参与裁剪）
+    if index is None:
+        index = build_annotation_index(mydatasets_dir, num_workers=num_workers)
+    all_data = defaultdict(list)
+    for image_id, image in enumerate(index.images):
+        if image.endswith(".jpg"):
+            image_file = os.path.join(mydatasets_dir, image)
+            for _, class_id, *bbox in index.boxes_for(image_id):
+                all_data[CLASS_NAMES[class_id]].append({"image": image_file, "bbox": _bbox_dict(*bbox)})
+
+    # 打印总分类统计信息
+    print("\nTotal train per category:")
+    for category in categories:
+        print(f"  {category}: {len(all_data[category])} train")
+
+    # 按稳定哈希划分，每个类别单独作为哈希盐的一部分
+    salt = "" if seed is None else str(seed)
+    train_data = defaultdict(list)
+    val_data = defaultdict(list)
+    for category in categories:
+        data = all_data[category]
+        keys = [_item_key(item) for item in data]
+        assignment = hash_split(keys, split_ratio, salt=f"{salt}:{category}")
+        train_data[category] = [item for item, key in zip(data, keys) if assignment[key] == "train"]
+        val_data[category] = [item for item, key in zip(data, keys) if assignment[key] == "val"]
+
+    # 按原图汇总所有裁剪任务，每张原图只解码一次；
+    # 同一原图中同类别的多个目标保存路径相同，按处理顺序保留最后一个
+    crops_by_image = defaultdict(dict)
+    for split, data_dict in [("train", train_data), ("val", val_data)]:
+        for category, items in data_dict.items():
+            save_dir = os.path.join(output_dir, split, category)
+            for item in items:
+                save_path = os.path.join(save_dir, f"{os.path.basename(item['image'])}_{category}.jpg")
+                crops_by_image[item["image"]][save_path] = item["bbox"]
+
+    # 裁剪并保存图片
+    num_workers = num_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * num_workers
+    tasks = [(image_path, list(crops.items())) for image_path, crops in crops_by_image.items()]
+    if output_format == "packed":
+        # 分片中的样本名为 <类别>/<文件名>，按名称排序保证相同输入得到相同的打包顺序
+        writers = {}
+        for split in ["train", "val"]:
+            names = sorted(os.path.relpath(save_path, os.path.join(output_dir, split))
+                           for crops in crops_by_image.values() for save_path in crops
+                           if os.path.relpath(save_path, output_dir).split(os.sep)[0] == split)
+            labels = [categories.index(name.split(os.sep)[0]) for name in names]
+            writers[split] = PackedCropWriter(output_dir, split, names, labels, categories, crop_size, shard_size)
+        worker, args = _crop_image_packed, (padding, crop_size)
+
+        def handle(results):
+            for save_path, crop in results:
+                split, name = os.path.relpath(save_path, output_dir).split(os.sep, 1)
+                writers[split].write(name, crop)
+    else:
+        worker, args = _crop_image, (padding,)
+        handle = lambda results: None
+
+    with metrics.stage("crop"), tqdm(total=len(tasks), desc="Cropping images") as progress:
+        if num_workers == 1:
+            for image_path, crops in tasks:
+                handle(worker(image_path, crops, *args))
+                progress.update()
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                pending = deque()
+                for image_path, crops in tasks:
+                    pending.append(executor.submit(worker, image_path, crops, *args))
+                    if len(pending) >= max_in_flight:
+                        handle(pending.popleft().result())
+                        progress.update()
+                while pending:
+                    handle(pending.popleft().result())
+                    progress.update()
+    if output_format == "packed":
+        for writer in writers.values():
+            writer.close()
+
+    metrics.count("crops_written", sum(len(crops) for _, crops in tasks))
+
+    # 打印训练集和验证集统计信息
+    print("\nDataset split statistics:")
+    for category in categories:
+        print(f"  {category}:")
+        print(f"    Train: {len(train_data[category])} train")
+        print(f"    Val:   {len(val_data[category])} train")
+
+    print("Classification dataset created successfully.")
+
+
+if __name__ == "__main__":
+    # 输入和输出路径
+    mydatasets_dir = "../mydatasets"
+    output_dir = "classification_dataset"
+    output_format = "jpeg"  # 共享存储上小文件开销大时设为 "packed"，裁剪图写入内存映射分片
+
+    # 清空输出目录
+    clear_output_directory(output_dir)
+
+    # 检查并修复损坏的图片
+    check_and_fix_images(mydatasets_dir)
+
+    # 创建分类数据集
+    create_classification_dataset(mydatasets_dir, output_dir, split_ratio=0.9, padding=0.15,
+                                  output_format=output_format)
@@ -1,76 +1,329 @@
-import os
-import xml.etree.ElementTree as ET
-import shutil
-
-very_low = []
-low = []
-normal = []
-high = []
-very_low_set = []
-low_set = []
-normal_set = []
-high_set = []
-
-
-def convert_xml_to_yolo(txt_output_dir, xml_input_dir):
-    if not os.path.exists(txt_output_dir):
-        os.makedirs(txt_output_dir, exist_ok=True)
-
-    for file in os.listdir(xml_input_dir):
-        if file.endswith('.xml'):
-            xml_path = os.path.join(xml_input_dir, file)
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-
-            image_file = root.find('filename').text
-            width = int(root.find('size/width').text)
-            height = int(root.find('size/height').text)
-
-            txt_file = os.path.join(txt_output_dir, file.replace('.xml', '.txt'))
-            with open(txt_file, 'w') as f:
-                for obj in root.findall('object'):
-                    label = obj.find('name').text
-                    if label == 'Very low':
-                        class_id = 0
-                        very_low.append(1)
-                        very_low_set.append(txt_file)
-                    elif label == 'low':
-                        class_id = 1
-                        low.append(1)
-                        low_set.append(txt_file)
-                    elif label == 'normal':
-                        class_id = 2
-                        normal.append(1)
-                        normal_set.append(txt_file)
-                    elif label == 'high':
-                        class_id = 3
-                        high.append(1)
-                        high_set.append(txt_file)
-                    else:
-                        continue
-
-                    bbox = obj.find('bndbox')
-                    xmin = int(bbox.find('xmin').text)
-                    ymin = int(bbox.find('ymin').text)
-                    xmax = int(bbox.find('xmax').text)
-                    ymax = int(bbox.find('ymax').text)
-
-                    x_center = (xmin + xmax) / 2 / width
-                    y_center = (ymin + ymax) / 2 / height
-                    w = (xmax - xmin) / width
-                    h = (ymax - ymin) / height
-
-                    f.write(f"{class_id} {x_center} {y_center} {w} {h}\n")
-
-        elif file.endswith('.txt'):
-            # 直接复制现有的YOLO格式标注文件
-            src_txt_path = os.path.join(xml_input_dir, file)
-            dst_txt_path = os.path.join(txt_output_dir, file)
-            shutil.copy(src_txt_path, dst_txt_path)
-
-
-if __name__ == "__main__":
-    txt_output_dir = 'D:\zxb\301\yolov8\yolov8\datasets\data\labels'
-    xml_input_dir = 'D:\zxb\301\301_nail_detection\301_nail_detection\mydatasets'
-    convert_xml_to_yolo(txt_output_dir, xml_input_dir)
-    print(len(very_low), len(low), len(normal), len(high))
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from annotation_index import CLASS_NAMES, build_annotation_index, parse_voc
+from file_utils import file_sha256, link_or_copy, load_json, save_json
+from instrumentation import get_logger, metrics
+
+logger = get_logger(__name__)
+
+
+MANIFEST_NAME = '.convert_manifest.json'
+
+
+@dataclass
+class ConversionSummary:
+    """转换统计：每个类别的目标框数量、包含该类别的标注文件数量，以及本次实际处理的文件"""
+    box_counts: list = field(default_factory=lambda: [0] * len(CLASS_NAMES))
+    file_counts: list = field(default_factory=lambda: [0] * len(CLASS_NAMES))
+    converted: int = 0
+    copied: int = 0
+    skipped: int = 0
+    missing_size: int = 0
+    removed: list = field(default_factory=list)
+    touched: list = field(default_factory=list)
+
+    def add_counts(self, class_counts):
+        for class_id, count in enumerate(class_counts):
+            self.box_counts[class_id] += count
+            self.file_counts[class_id] += count > 0
+
+    def __str__(self):
+        counts = ", ".join(f"{name}: {count}" for name, count in zip(CLASS_NAMES, self.box_counts))
+        text = f"转换 {self.converted} 个 XML，复制 {self.copied} 个 TXT；目标框数量 {counts}"
+        if self.skipped or self.removed:
+            text += f"；跳过未变化文件 {self.skipped} 个，删除过期标签 {len(self.removed)} 个"
+        if self.missing_size:
+            text += f"；缺少图片尺寸跳过 {self.missing_size} 个"
+        return text
+
+
+def yolo_label_text(width, height, boxes):
+    """将 [(类别 id, xmin, ymin, xmax, ymax)] 转换为 YOLO TXT 内容，返回 (文本, 每个类别的目标框数量)"""
+    class_counts = [0] * len(CLASS_NAMES)
+    lines = []
+    for class_id, xmin, ymin, xmax, ymax in boxes:
+        class_id, xmin, ymin, xmax, ymax = int(class_id), int(xmin), int(ymin), int(xmax), int(ymax)
+        class_counts[class_id] += 1
+
+        x_center = (xmin + xmax) / 2 / width
+        y_center = (ymin + ymax) / 2 / height
+        w = (xmax - xmin) / width
+        h = (ymax - ymin) / height
+
+        lines.append(f"{class_id} {x_center} {y_center} {w} {h}\n")
+    return "".join(lines), class_counts
+
+
+def convert_xml_file(xml_path, txt_file):
+    """
+    将单个 VOC XML 转换为 YOLO TXT，返回每个类别的目标框数量；目标框解析规则见 annotation_index.parse_voc
+    XML 缺少图片尺寸时无法归一化，跳过该文件（删除已有的输出标签）并返回 None
+    """
+    width, height, boxes = parse_voc(xml_path)
+    if width <= 0 or height <= 0:
+        _skip_missing_size(xml_path, txt_file)
+        return None
+    text, class_counts = yolo_label_text(width, height, boxes)
+    with open(txt_file, 'w') as f:
+        f.write(text)
+    return class_counts
+
+
+def _skip_missing_size(xml_path, txt_file):
+    logger.warning("跳过 %s：缺少图片尺寸，无法归一化坐标", xml_path)
+    if os.path.exists(txt_file):
+        os.remove(txt_file)
+
+
+def _source_record(path, output, class_counts, stat=None):
+    """清单记录：源文件的大小、修改时间与内容哈希 -> 输出文件（缺少图片尺寸而跳过时为 None）与类别计数"""
+    stat = stat or os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path),
+            'output': output, 'counts': class_counts}
+
+
+def _record_unchanged(record, txt_output_dir, path, size, mtime_ns):
+    """
+    清单记录仍然有效：输出文件存在（或记录为缺少尺寸而跳过），且源文件大小和修改时间未变或内容哈希未变；
+    只有修改时间变化时更新记录
+    """
+    if record is None:
+        return False
+    if record['output'] is not None and not os.path.exists(os.path.join(txt_output_dir, record['output'])):
+        return False
+    if record['size'] == size and record['mtime_ns'] == mtime_ns:
+        return True
+    if record['sha256'] == file_sha256(path):
+        record['size'], record['mtime_ns'] = size, mtime_ns
+        return True
+    return False
+
+
+def _skip_unchanged(record, summary):
+    summary.skipped += 1
+    if record['counts'] is not None:
+        summary.add_counts(record['counts'])
+
+
+def _remove_stale(manifest, seen, txt_output_dir, summary):
+    """源文件已删除的，删除对应的输出标签与清单记录"""
+    for file in set(manifest) - seen:
+        record = manifest.pop(file)
+        if record['output'] is None:
+            continue
+        output_path = os.path.join(txt_output_dir, record['output'])
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        summary.removed.append(record['output'])
+
+
+def write_yolo_labels(index, txt_output_dir, manifest_path=None):
+    """
+    直接由标注索引（annotation_index.AnnotationIndex）写出 YOLO TXT，不再解析 XML；与 convert_xml_to_yolo 的增量模式
+    共用同一份清单（默认 txt_output_dir/.convert_manifest.json），XML 未变化的标注直接跳过，内容未变化的标签不重写，
+    保留修改时间，后续 split_dataset 不会重复放置。索引源目录中已有的 TXT 标签（没有对应 XML 的）直接复制；
+    源文件已删除的输出标签被删除；缺少图片尺寸的标注跳过并记录警告，清单中记为无输出，之后不再重复处理。
+    返回 ConversionSummary
+    """
+    os.makedirs(txt_output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(txt_output_dir, MANIFEST_NAME)
+    manifest = load_json(manifest_path, {})
+    summary = ConversionSummary()
+    seen = set()
+    with metrics.stage("convert"):
+        for image_id, name in enumerate(index.names):
+            file = name + '.xml'
+            seen.add(file)
+            xml_path = os.path.join(index.source_dir, file)
+            txt_file = os.path.join(txt_output_dir, name + '.txt')
+            width, height = index.widths[image_id], index.heights[image_id]
+            has_size = width > 0 and height > 0
+            record = manifest.get(file)
+            if _record_unchanged(record, txt_output_dir, xml_path, int(index.xml_sizes[image_id]),
+                                 int(index.xml_mtimes[image_id])) and (record['output'] is not None) == has_size:
+                _skip_unchanged(record, summary)
+                continue
+
+            summary.touched.append(file)
+            if not has_size:
+                # 图片尺寸也可能来自图片文件头，因此按索引判断，而不是重新解析 XML
+                _skip_missing_size(xml_path, txt_file)
+                manifest[file] = _source_record(xml_path, None, None)
+                summary.missing_size += 1
+                continue
+            text, class_counts = yolo_label_text(width, height, index.boxes_for(image_id)[:, 1:])
+            summary.add_counts(class_counts)
+            manifest[file] = _source_record(xml_path, name + '.txt', class_counts)
+            if os.path.exists(txt_file):
+                with open(txt_file, 'r') as f:
+                    if f.read() == text:
+                        summary.skipped += 1
+                        continue
+            with open(txt_file, 'w') as f:
+                f.write(text)
+            summary.converted += 1
+
+        indexed = set(index.names)
+        with os.scandir(index.source_dir) as entries:
+            for entry in entries:
+                file = entry.name
+                if not file.endswith('.txt') or os.path.splitext(file)[0] in indexed:
+                    continue
+                seen.add(file)
+                stat = entry.stat()
+                record = manifest.get(file)
+                if _record_unchanged(record, txt_output_dir, entry.path, stat.st_size, stat.st_mtime_ns):
+                    _skip_unchanged(record, summary)
+                    continue
+                link_or_copy(entry.path, os.path.join(txt_output_dir, file))
+                manifest[file] = _source_record(entry.path, file, None, stat)
+                summary.touched.append(file)
+                summary.copied += 1
+
+        _remove_stale(manifest, seen, txt_output_dir, summary)
+    save_json(manifest_path, manifest)
+    metrics.count("labels_converted", summary.converted)
+    metrics.count("labels_copied", summary.copied)
+    return summary
+
+
+def _output_name(file):
+    return file.replace('.xml', '.txt')
+
+
+def _convert_chunk(txt_output_dir, xml_input_dir, files, with_stat=False):
+    """
+    进程池任务：转换（或复制）一批文件，返回 [(文件名, 类别计数, 清单记录)]
+    复制的 TXT 与缺少图片尺寸而跳过的 XML 类别计数为 None；with_stat 为 True 时同时生成清单记录
+    """
+    results = []
+    for file in files:
+        src_path = os.path.join(xml_input_dir, file)
+        output = _output_name(file)
+        if file.endswith('.xml'):
+            class_counts = convert_xml_file(src_path, os.path.join(txt_output_dir, output))
+            if class_counts is None:
+                output = None
+        else:
+            # 直接复制现有的YOLO格式标注文件
+            shutil.copy(src_path, os.path.join(txt_output_dir, file))
+            class_counts = None
+
+        record = _source_record(src_path, output, class_counts) if with_stat else None
+        results.append((file, class_counts, record))
+    return results
+
+
+def _iter_chunks(xml_input_dir, chunk_size):
+    """流式遍历输入目录，按 chunk_size 分批产出需要处理的文件名"""
+    chunk = []
+    with os.scandir(xml_input_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(('.xml', '.txt')):
+                chunk.append(entry.name)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def _scan_changes(xml_input_dir, txt_output_dir, manifest, summary, chunk_size):
+    """
+    增量模式：对比清单找出新增或修改的文件，按 chunk_size 分批产出；
+    大小和修改时间未变、或内容哈希未变的文件直接跳过（缺少图片尺寸而跳过的 XML 同样不再重复处理），
+    并沿用清单中记录的类别计数
+    """
+    seen = set()
+    chunk = []
+    with os.scandir(xml_input_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(('.xml', '.txt')):
+                continue
+            file = entry.name
+            seen.add(file)
+            stat = entry.stat()
+            record = manifest.get(file)
+            if _record_unchanged(record, txt_output_dir, entry.path, stat.st_size, stat.st_mtime_ns):
+                _skip_unchanged(record, summary)
+                continue
+
+            chunk.append(file)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+    _remove_stale(manifest, seen, txt_output_dir, summary)
+
+
+def convert_xml_to_yolo(txt_output_dir, xml_input_dir, num_workers=None, chunk_size=256, incremental=False,
+                        manifest_path=None):
+    """
+    将 xml_input_dir 中的 VOC XML 转换为 YOLO TXT，已有的 TXT 直接复制，返回 ConversionSummary
+    num_workers: 进程数，默认使用全部 CPU；为 1 时在当前进程串行执行
+    chunk_size: 每个进程任务处理的文件数，同时在途的任务数限制为 2 * num_workers，内存占用与目录大小无关
+    incremental: 增量模式，依据清单 (路径, 修改时间, 大小, 内容哈希 -> 输出文件) 只处理变化的文件，
+                 并删除源文件已不存在的输出标签；清单默认保存在 txt_output_dir/.convert_manifest.json
+    """
+    if not os.path.exists(txt_output_dir):
+        os.makedirs(txt_output_dir, exist_ok=True)
+
+    num_workers = num_workers or os.cpu_count() or 1
+    summary = ConversionSummary()
+
+    if incremental:
+        manifest_path = manifest_path or os.path.join(txt_output_dir, MANIFEST_NAME)
+        manifest = load_json(manifest_path, {})
+        chunks = _scan_changes(xml_input_dir, txt_output_dir, manifest, summary, chunk_size)
+    else:
+        manifest = None
+        chunks = _iter_chunks(xml_input_dir, chunk_size)
+
+    def collect(results):
+        for file, class_counts, record in results:
+            if not file.endswith('.xml'):
+                summary.copied += 1
+            elif class_counts is None:
+                summary.missing_size += 1
+            else:
+                summary.converted += 1
+                summary.add_counts(class_counts)
+            if manifest is not None:
+                manifest[file] = record
+                summary.touched.append(file)
+
+    if num_workers == 1:
+        with metrics.stage("convert"):
+            for chunk in chunks:
+                collect(_convert_chunk(txt_output_dir, xml_input_dir, chunk, incremental))
+    else:
+        with metrics.stage("convert"), ProcessPoolExecutor(max_workers=num_workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_convert_chunk, txt_output_dir, xml_input_dir, chunk, incremental))
+                if len(pending) >= 2 * num_workers:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+    if manifest is not None:
+        save_json(manifest_path, manifest)
+    metrics.count("labels_converted", summary.converted)
+    metrics.count("labels_copied", summary.copied)
+    return summary
+
+
+if __name__ == "__main__":
+    txt_output_dir = 'D:\zxb\301\yolov8\yolov8\datasets\data\labels'
+    xml_input_dir = 'D:\zxb\301\301_nail_detection\301_nail_detection\mydatasets'
+    # 标注索引只在 XML 变化时重新解析，分类裁剪与数据集划分共用同一份索引；
+    # 标签按清单增量写出，与 convert_xml_to_yolo(incremental=True) 共用 .convert_manifest.json
+    index = build_annotation_index(xml_input_dir)
+    summary = write_yolo_labels(index, txt_output_dir)
+    print(summary)
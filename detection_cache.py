@@ -0,0 +1,67 @@
+import os
+import hashlib
+import numpy as np
+
+from file_utils import file_sha256, load_json, path_sha256, save_json
+
+CACHE_VERSION = 1
+
+
+class DetectionCache:
+    """
+    原始检测结果 (N, 6) [x1, y1, x2, y2, conf, cls] 的磁盘缓存
+    缓存键为 模型权重哈希（目录格式的模型按目录内全部文件计算）+ 图片内容哈希，任一变化都会自动失效；
+    文件哈希按 (路径, 大小, 修改时间) 记录在索引中，未变化的文件无需重新读取计算。
+    tag 用于区分同一权重下不同的推理设置（如分块推理、TTA 等）。
+    """
+
+    def __init__(self, cache_dir, model_path, tag=""):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, "file_hashes.json")
+        self._index = load_json(self.index_path, {})
+        self._dirty = False
+
+        key = f"v{CACHE_VERSION}:{path_sha256(model_path, self.file_hash)}:{tag}"
+        self.model_key = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        self.entry_dir = os.path.join(cache_dir, self.model_key)
+        os.makedirs(self.entry_dir, exist_ok=True)
+
+    def file_hash(self, path):
+        """返回文件内容哈希，大小和修改时间未变时直接使用索引中的记录"""
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        record = self._index.get(abs_path)
+        if record and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            return record[2]
+        digest = file_sha256(path)
+        self._index[abs_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._dirty = True
+        return digest
+
+    def _entry_path(self, img_path):
+        return os.path.join(self.entry_dir, self.file_hash(img_path) + ".npy")
+
+    def get(self, img_path):
+        """读取缓存的检测框数组，未命中时返回 None"""
+        entry_path = self._entry_path(img_path)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            return np.load(entry_path)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, img_path, pred):
+        """写入一张图片的检测框数组（先写临时文件再替换，避免中断留下半个文件）"""
+        entry_path = self._entry_path(img_path)
+        tmp_path = entry_path + ".tmp.npy"
+        np.save(tmp_path, np.asarray(pred, dtype=np.float32))
+        os.replace(tmp_path, entry_path)
+
+    def save_index(self):
+        """保存文件哈希索引"""
+        if not self._dirty:
+            return
+        save_json(self.index_path, self._index)
+        self._dirty = False
@@ -1,99 +1,422 @@
-import os
-import torch
-from ultralytics import YOLO
-import cv2
-import numpy as np
-import pandas as pd
-
-def detect_and_classify(model, img_path, thresholds):
-    """检测并根据阈值分类单张图片"""
-    img = cv2.imread(img_path)
-    if img is None:
-        print(f"Error: Unable to load image {img_path}")
-        return {}
-
-    results = model(img)
-    pred = results[0].boxes.data.cpu().numpy() if hasattr(results[0], 'boxes') and results[0].boxes is not None else np.array([])
-    pred_class_ids = pred[:, 5].astype(int) if pred.size > 0 else np.array([])
-    total_boxes = len(pred_class_ids)
-    normal_count = (pred_class_ids == 2).sum() if pred.size > 0 else 0
-
-    image_results = {}
-    for threshold in thresholds:
-        classification = "unfit"
-        if total_boxes > 0 and normal_count / total_boxes >= threshold:
-            classification = "fit"
-        image_results[threshold] = classification
-
-    # image_results = {
-    #     0.5:fit",
-    #     0.6:"fit",
-    #     0.7: "fit",
-    #     0.8: "unfit",
-    # }
-
-    return image_results
-
-def evaluate_dataset(model_path, image_dir, thresholds):
-    """评估数据集，计算真阳率和真阴率"""
-    model = YOLO(model_path)
-    image_files = sorted([f for f in os.listdir(image_dir) if f.endswith(('.jpg', '.png'))])
-
-    r_fit_count = 0
-    r_unfit_count = 0
-    results_data = []
-
-    for file in image_files:  # 不需要索引 i
-        img_path = os.path.join(image_dir, file)
-
-        # 根据文件名判断真实标签
-        if file.startswith("ab"):
-            true_label = "r_unfit"
-            r_unfit_count += 1
-        elif file.startswith("no"):
-            true_label = "r_fit"
-            r_fit_count += 1
-        else:
-            print(f"警告: 文件名 {file} 不符合命名规则，跳过。")
-            continue  # 跳过不符合规则的文件
-
-        image_results = detect_and_classify(model, img_path, thresholds)
-        for threshold, predicted_label in image_results.items():
-            results_data.append([file, true_label, threshold, predicted_label])
-        # [
-        #     ["image0.jpg", "r_fit", 0.5, "fit"],
-        #     ["image0.jpg", "r_fit", 0.6, "fit"],
-        #     ["image0.jpg", "r_fit", 0.7, "fit"],
-        #     ["image0.jpg", "r_fit", 0.8, "unfit"],
-        # ]
-
-    df = pd.DataFrame(results_data, columns=['Filename', 'True Label', 'Threshold', 'Predicted Label'])
-
-    results = {}
-    for threshold in thresholds:
-        df_threshold = df[df['Threshold'] == threshold]
-        true_negative = len(df_threshold[(df_threshold['True Label'] == 'r_fit') & (df_threshold['Predicted Label'] == 'fit')])
-        true_positive = len(df_threshold[(df_threshold['True Label'] == 'r_unfit') & (df_threshold['Predicted Label'] == 'unfit')])
-
-        tnr = true_negative / r_fit_count if r_fit_count > 0 else 0
-        tpr = true_positive / r_unfit_count if r_unfit_count > 0 else 0
-        results[threshold] = {"TPR": tpr, "TNR": tnr}
-
-    return results
-
-if __name__ == "__main__":
-    model_path = './runs/train/custom_experiment_8s_0902_0.001_20018/weights/best.pt'
-    image_dir = './TestDatasets'
-    thresholds = [0.57, 0.7, 0.8]
-
-    try:
-        results = evaluate_dataset(model_path, image_dir, thresholds)
-        df_results = pd.DataFrame.from_dict(results, orient='index')
-        df_results.index.name = "Threshold"
-        df_results.columns = ['真阳率(TPR)', '真阴率(TNR)']
-        print(df_results)
-        df_results.to_csv("./results.csv", encoding="utf-8-sig")
-    except ValueError as e:
-        print(f"Error: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+import os
+import csv
+import json
+import hashlib
+import cv2
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from detection_cache import DetectionCache
+from file_utils import load_json, path_sha256, save_json
+from hash_split import hash_shard
+from instrumentation import get_logger, metrics
+from threshold_metrics import RunningCounts, format_roc_summary, normal_ratio, threshold_table, write_roc_report
+
+logger = get_logger(__name__)
+
+
+def load_model(model_path, **model_options):
+    """
+    按权重格式加载检测模型：.onnx 使用 ONNX Runtime（不导入 torch，model_options 传给 OnnxDetector），
+    其他格式（.pt、OpenVINO 模型目录等）使用 ultralytics.YOLO
+    """
+    if model_path.endswith(".onnx"):
+        from onnx_backend import OnnxDetector
+        return OnnxDetector(model_path, **model_options)
+    from ultralytics import YOLO
+    return YOLO(model_path)
+
+
+class LazyModel:
+    """首次调用时才加载模型：检测缓存全部命中时无需加载权重，分批处理时多次调用共享同一个模型"""
+
+    def __init__(self, model_path, **model_options):
+        self.model_path = model_path
+        self.model_options = model_options
+        self.model = None
+
+    def __call__(self, imgs, *args, **kwargs):
+        if self.model is None:
+            self.model = load_model(self.model_path, **self.model_options)
+        return self.model(imgs, *args, **kwargs)
+
+
+def boxes_to_array(result):
+    """从单个 YOLO 结果中取出 (N, 6) 的检测框数组 [x1, y1, x2, y2, conf, cls]；ONNX 后端直接返回数组"""
+    if isinstance(result, np.ndarray):
+        return result
+    return result.boxes.data.cpu().numpy() if hasattr(result, 'boxes') and result.boxes is not None else np.array([])
+
+
+def classify_detections(pred, thresholds):
+    """根据检测框数组中 normal 类别的占比，按阈值判定 fit/unfit"""
+    pred_class_ids = pred[:, 5].astype(int) if pred.size > 0 else np.array([])
+    total_boxes = len(pred_class_ids)
+    normal_count = (pred_class_ids == 2).sum() if pred.size > 0 else 0
+
+    image_results = {}
+    for threshold in thresholds:
+        classification = "unfit"
+        if total_boxes > 0 and normal_count / total_boxes >= threshold:
+            classification = "fit"
+        image_results[threshold] = classification
+
+    # image_results = {
+    #     0.5:fit",
+    #     0.6:"fit",
+    #     0.7: "fit",
+    #     0.8: "unfit",
+    # }
+
+    return image_results
+
+
+def detect_and_classify(model, img_path, thresholds):
+    """检测并根据阈值分类单张图片"""
+    img = cv2.imread(img_path)
+    if img is None:
+        print(f"Error: Unable to load image {img_path}")
+        return {}
+
+    results = model(img)
+    pred = boxes_to_array(results[0])
+    return classify_detections(pred, thresholds)
+
+
+def prefetch_images(img_paths, num_workers=4, queue_depth=16, loader=cv2.imread):
+    """在线程池中用 loader 预先解码图片，按输入顺序逐张产出 (路径, 图片)，最多同时解码 queue_depth 张"""
+    def timed_loader(img_path):
+        with metrics.stage("decode"):
+            return loader(img_path)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for img_path in img_paths:
+            pending.append((img_path, executor.submit(timed_loader, img_path)))
+            if len(pending) >= queue_depth:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def _run_batch(model, paths, imgs):
+    """对同尺寸的一批图片做一次前向推理，逐张产出 (路径, 检测框数组)"""
+    with metrics.stage("inference"):
+        results = model(imgs) if len(imgs) > 1 else model(imgs[0])
+    metrics.observe("batch_size", len(imgs), buckets=(1, 2, 4, 8, 16, 32, 64))
+    with metrics.stage("postprocess"):
+        preds = [boxes_to_array(result) for result in results]
+    yield from zip(paths, preds)
+
+
+def detect_batches(model, img_paths, batch_size=8, num_workers=4, queue_depth=16):
+    """
+    流水线批量推理：解码线程池与模型推理重叠执行，逐张产出 (路径, 检测框数组)
+    同一批次只放相同尺寸的图片，保证 letterbox 方式与逐张推理一致，结果完全相同；
+    无法读取的图片产出 (路径, None)。产出顺序不保证与输入顺序一致。
+    """
+    batch_size = max(1, batch_size)
+    max_buffered = max(queue_depth, batch_size)
+    buckets = OrderedDict()  # 图片尺寸 -> ([路径], [图片])
+    buffered = 0
+
+    for img_path, img in prefetch_images(img_paths, num_workers=num_workers, queue_depth=queue_depth):
+        if img is None:
+            logger.warning("Error: Unable to load image %s", img_path)
+            metrics.count("images_unreadable")
+            yield img_path, None
+            continue
+
+        paths, imgs = buckets.setdefault(img.shape, ([], []))
+        paths.append(img_path)
+        imgs.append(img)
+        buffered += 1
+
+        if len(imgs) >= batch_size:
+            del buckets[img.shape]
+            buffered -= len(imgs)
+            yield from _run_batch(model, paths, imgs)
+        elif buffered >= max_buffered:
+            # 缓冲的图片过多时，先推理最大的一组，控制内存占用
+            shape = max(buckets, key=lambda s: len(buckets[s][1]))
+            paths, imgs = buckets.pop(shape)
+            buffered -= len(imgs)
+            yield from _run_batch(model, paths, imgs)
+
+    for paths, imgs in buckets.values():
+        yield from _run_batch(model, paths, imgs)
+
+
+RUNTIME_OPTIONS = ("intra_op_threads", "inter_op_threads", "providers")  # 只影响速度，不影响检测结果
+
+
+def options_tag(model_options):
+    """model_options 中影响检测结果的参数（如 ONNX 的 imgsz / conf_threshold / iou_threshold），用于缓存键与续跑标识"""
+    return ",".join(f"{key}={value}" for key, value in sorted((model_options or {}).items())
+                    if key not in RUNTIME_OPTIONS)
+
+
+def cache_tag(*parts):
+    """由各项推理设置组成 DetectionCache 的 tag；全部为默认设置时为空字符串，与普通推理共用缓存"""
+    return ";".join(part for part in parts if part)
+
+
+def _is_ensemble(model_path, tta_views):
+    return isinstance(model_path, (list, tuple)) or bool(tta_views)
+
+
+def _make_ensemble(model_path, tta_views, model_options=None):
+    """由权重路径（或路径列表）与增强视图创建 Ensemble，tta_views 为空时只使用原图"""
+    from ensemble import Ensemble
+    model_paths = list(model_path) if isinstance(model_path, (list, tuple)) else [model_path]
+    return Ensemble(model_paths, views=tta_views or [(False, None)], model_options=model_options)
+
+
+def collect_detections(model_path, img_paths, batch_size=1, num_workers=4, queue_depth=16, cache_dir=None,
+                       tile_size=None, tile_overlap=0.2, max_side=None, model_options=None, model=None,
+                       tta_views=None):
+    """
+    获取每张图片的原始检测框数组，返回 {图片路径: 检测框数组}，读取失败的图片对应 None
+    指定 cache_dir 时优先读取检测缓存，只对未命中的图片加载模型并推理
+    tile_size: 指定时使用分块推理（见 tiled_inference.py），tile_overlap 为相邻分块的重叠比例，
+               max_side 为缩小解码后长边的下限
+    model_options: 传给 load_model 的后端参数，如 ONNX 的 intra_op_threads / inter_op_threads；
+                   影响检测结果的参数（imgsz / conf_threshold 等）计入缓存键
+    model: 已创建的模型（如多次调用共享的 LazyModel），为 None 时按 model_path 创建
+    model_path 为权重路径列表或指定 tta_views 时使用集成模式（见 ensemble.py），返回融合后的检测框
+    """
+    if _is_ensemble(model_path, tta_views):
+        if tile_size:
+            raise ValueError("Ensemble / TTA mode cannot be combined with tiled inference")
+        model = model or _make_ensemble(model_path, tta_views, model_options)
+        return model.detect(img_paths, batch_size=batch_size, num_workers=num_workers, queue_depth=queue_depth,
+                            cache_dir=cache_dir)
+
+    tag = cache_tag(f"tile={tile_size},{tile_overlap},{max_side}" if tile_size else "", options_tag(model_options))
+    cache = DetectionCache(cache_dir, model_path, tag=tag) if cache_dir else None
+    predictions = {}
+    misses = []
+    with metrics.stage("cache_read"):
+        for img_path in img_paths:
+            pred = cache.get(img_path) if cache is not None else None
+            if pred is None:
+                misses.append(img_path)
+            else:
+                predictions[img_path] = pred
+    metrics.count("cache_hits", len(img_paths) - len(misses))
+    metrics.count("cache_misses", len(misses))
+
+    if misses:
+        model = model or LazyModel(model_path, **(model_options or {}))
+        if tile_size:
+            from tiled_inference import detect_tiled
+            detections = detect_tiled(model, misses, tile_size=tile_size, overlap=tile_overlap, max_side=max_side,
+                                      batch_size=batch_size, num_workers=num_workers, queue_depth=queue_depth)
+        else:
+            detections = detect_batches(model, misses, batch_size=batch_size,
+                                        num_workers=num_workers, queue_depth=queue_depth)
+        for img_path, pred in detections:
+            predictions[img_path] = pred
+            if cache is not None and pred is not None:
+                with metrics.stage("cache_write"):
+                    cache.put(img_path, pred)
+
+    if cache is not None:
+        cache.save_index()
+        print(f"检测缓存命中 {len(img_paths) - len(misses)} 张，推理 {len(misses)} 张。")
+    return predictions
+
+
+def label_image_files(image_files):
+    """根据文件名判断真实标签，产出 (文件名, 是否为 unfit)，不符合命名规则的文件跳过"""
+    for file in image_files:
+        if file.startswith("ab"):
+            yield file, True  # r_unfit
+        elif file.startswith("no"):
+            yield file, False  # r_fit
+        else:
+            logger.warning("警告: 文件名 %s 不符合命名规则，跳过。", file)
+
+
+def _stream_fingerprint(model_path, detect_options, model_options=None):
+    """流式评估结果的来源标识：模型权重哈希与影响检测结果的推理设置，任一变化时不能续用旧结果"""
+    model_paths = model_path if isinstance(model_path, (list, tuple)) else [model_path]
+    settings = [[path_sha256(path) if os.path.exists(path) else path for path in model_paths]]
+    settings += [detect_options.get(key) for key in ("tile_size", "tile_overlap", "max_side", "tta_views")]
+    settings.append(options_tag(model_options))
+    return hashlib.sha256(json.dumps(settings, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def _open_stream(results_path, resume, counts, fingerprint, labeled_files):
+    """
+    打开逐张结果文件：可续跑时截断到上一个检查点并用已有记录恢复计数器，返回 (文件, 已完成的文件名集合)
+    检查点 <results_path>.checkpoint.json 记录模型标识、最后一个完整分批结束时结果文件的字节偏移，
+    以及全部图片是否已完成；模型或推理设置不同时重新开始。已有记录逐行读取，不整体载入内存；
+    图片已被删除的记录从结果文件中移除，其余结果保留
+    """
+    checkpoint_path = results_path + ".checkpoint.json"
+    checkpoint = load_json(checkpoint_path) if resume and os.path.exists(results_path) else None
+    if checkpoint is not None and checkpoint.get("model") != fingerprint:
+        print(f"{results_path} 由其他模型或推理设置生成，重新开始评估")
+        checkpoint = None
+    if checkpoint is None:
+        f = open(results_path, 'w', newline='', encoding='utf-8')
+        csv.writer(f).writerow(['Filename', 'True Label', 'Normal Ratio', 'Boxes'])
+        f.flush()
+        return f, set()
+
+    f = open(results_path, 'r+', newline='', encoding='utf-8')
+    f.truncate(checkpoint["offset"])  # 丢弃中断时未完成分批写入的记录
+    current = {file for file, _ in labeled_files}
+    done = set()
+    removed = 0
+    for row in csv.DictReader(f):
+        if row['Filename'] in current:
+            counts.update(float(row['Normal Ratio']), row['True Label'] == 'r_unfit')
+            done.add(row['Filename'])
+        else:
+            removed += 1
+
+    if removed:
+        # 流式复制到临时文件，去掉已删除图片的记录
+        f.seek(0)
+        tmp_path = results_path + ".tmp"
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            for i, row in enumerate(csv.reader(f)):
+                if i == 0 or row[0] in current:
+                    writer.writerow(row)
+        f.close()
+        os.replace(tmp_path, results_path)
+        f = open(results_path, 'a', newline='', encoding='utf-8')
+        save_json(checkpoint_path, {"model": fingerprint, "offset": f.tell(), "complete": False})
+        print(f"移除 {removed} 张已删除图片的结果")
+    else:
+        f.seek(0, os.SEEK_END)
+    print(f"从检查点恢复：已完成 {len(done)} 张")
+    return f, done
+
+
+def _evaluate_streaming(image_dir, labeled_files, thresholds, results_path, chunk_size, resume, detect_options):
+    """
+    流式评估：按文件名顺序分批推理，逐张结果追加写入 results_path，TPR/TNR 由计数器累加，
+    内存中只保留当前分批；每完成一个分批写一次检查点，中断后可从最后一个完整分批继续
+    再次运行时只评估结果文件中还没有的图片（如归档中新增的图片），模型不同时重新开始
+    """
+    counts = RunningCounts(thresholds)
+    model_path = detect_options.pop("model_path")
+    model_options = detect_options.pop("model_options") or {}
+    model = detect_options.pop("model") or LazyModel(model_path, **model_options)
+    fingerprint = _stream_fingerprint(model_path, detect_options, model_options)
+    checkpoint_path = results_path + ".checkpoint.json"
+    f, done = _open_stream(results_path, resume, counts, fingerprint, labeled_files)
+    writer = csv.writer(f)
+    pending = [(file, is_unfit) for file, is_unfit in labeled_files if file not in done]
+    try:
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            img_paths = [os.path.join(image_dir, file) for file, _ in chunk]
+            detections = collect_detections(model_path, img_paths, model=model, **detect_options)
+            for (file, is_unfit), img_path in zip(chunk, img_paths):
+                pred = detections.get(img_path)
+                ratio = normal_ratio(pred) if pred is not None else np.nan
+                counts.update(ratio, is_unfit)
+                writer.writerow([file, 'r_unfit' if is_unfit else 'r_fit', repr(float(ratio)),
+                                 len(pred) if pred is not None else ''])
+            f.flush()
+            save_json(checkpoint_path, {"model": fingerprint, "offset": f.tell(), "complete": False})
+        f.flush()
+        save_json(checkpoint_path, {"model": fingerprint, "offset": f.tell(), "complete": True})
+    finally:
+        f.close()
+    return counts.table()
+
+
+def evaluate_dataset(model_path, image_dir, thresholds, batch_size=1, num_workers=4, queue_depth=16, cache_dir=None,
+                     roc_dir=None, tile_size=None, tile_overlap=0.2, max_side=None, model_options=None,
+                     results_path=None, chunk_size=1000, resume=True, model=None, shard=None, tta_views=None):
+    """
+    评估数据集，计算真阳率和真阴率
+    batch_size: 每次送入模型的图片数量；num_workers / queue_depth: 预读取线程数与最大预读取张数
+    cache_dir: 检测结果缓存目录，重复调整阈值时无需重新推理
+    roc_dir: 若指定，则在该目录写入完整 ROC 曲线 (roc.csv) 与 AUC / 约登最优阈值 (roc_summary.json)
+    tile_size / tile_overlap / max_side: 高分辨率图片的分块推理参数，见 collect_detections
+    model_path 为 .onnx 时使用 ONNX Runtime CPU 后端，model_options 可设置 intra_op_threads / inter_op_threads
+    results_path: 若指定则使用流式评估，每 chunk_size 张图片为一个分批，逐张结果追加写入该 CSV，
+                  resume 为 True 时从上次中断的检查点继续，已完成的结果文件再次运行时只评估新增图片；
+                  模型或推理设置变化时重新开始
+    model: 已加载的模型（可调用对象），为 None 时按 model_path 加载
+    shard: (分片编号, 分片总数)，只评估文件名稳定哈希落在该分片的图片，见 sharded_eval.py
+    model_path 为权重路径列表或指定 tta_views（如 ensemble.DEFAULT_TTA_VIEWS）时，用多模型 / 测试时增强的
+    加权框融合结果评估；model 可传入已创建的 Ensemble 以指定各模型权重
+    """
+    if _is_ensemble(model_path, tta_views):
+        model = model or _make_ensemble(model_path, tta_views, model_options)  # 流式评估的各分批共享同一组模型
+
+    image_files = sorted([f for f in os.listdir(image_dir) if f.endswith(('.jpg', '.png'))])
+    if shard is not None:
+        shard_id, num_shards = shard
+        image_files = [f for f in image_files if hash_shard(f, num_shards) == shard_id]
+    labeled_files = list(label_image_files(image_files))
+    detect_options = dict(batch_size=batch_size, num_workers=num_workers, queue_depth=queue_depth,
+                          cache_dir=cache_dir, tile_size=tile_size, tile_overlap=tile_overlap, max_side=max_side,
+                          tta_views=tta_views)
+
+    if results_path is not None:
+        results = _evaluate_streaming(image_dir, labeled_files, thresholds, results_path, chunk_size, resume,
+                                      dict(detect_options, model_path=model_path, model_options=model_options,
+                                           model=model))
+        if roc_dir is not None:
+            # ROC 需要全部图片的 normal 占比，只读取这一列
+            per_image = pd.read_csv(results_path, usecols=['True Label', 'Normal Ratio'])
+            summary = write_roc_report(per_image['Normal Ratio'].to_numpy(dtype=np.float64),
+                                       (per_image['True Label'] == 'r_unfit').to_numpy(), roc_dir)
+            print(format_roc_summary(summary))
+        return results
+
+    img_paths = [os.path.join(image_dir, file) for file, _ in labeled_files]
+    detections = collect_detections(model_path, img_paths, model_options=model_options, model=model,
+                                    **detect_options)
+
+    # 每张图片只保留一个 normal 占比，阈值扫描在排序后的数组上一次完成；读取失败的图片记为 nan
+    ratios = np.array([normal_ratio(detections[img_path]) if detections.get(img_path) is not None else np.nan
+                       for img_path in img_paths], dtype=np.float64)
+    is_unfit = np.array([is_unfit for _, is_unfit in labeled_files], dtype=bool)
+
+    if roc_dir is not None:
+        summary = write_roc_report(ratios, is_unfit, roc_dir)
+        print(format_roc_summary(summary))
+
+    return threshold_table(ratios, is_unfit, thresholds)
+
+
+if __name__ == "__main__":
+    model_path = './runs/train/custom_experiment_8s_0902_0.001_20018/weights/best.pt'
+    image_dir = './TestDatasets'
+    thresholds = [0.57, 0.7, 0.8]
+    batch_size = 8  # 批量推理的图片数量，设为 1 即逐张推理
+    num_workers = 4  # 预读取解码线程数
+    cache_dir = './detection_cache'  # 检测结果缓存目录，设为 None 则不使用缓存
+    tile_size = None  # 高分辨率手机照片可设为 640 使用分块推理
+    max_side = None  # 分块推理时缩小解码后长边的下限，如 2048
+    results_path = None  # 大规模评估可设为 './per_image_results.csv'，流式写入并支持中断后续跑
+    tta_views = None  # 设为 ensemble.DEFAULT_TTA_VIEWS 使用翻转 / 多尺度测试时增强；model_path 可为多个权重的列表
+
+    try:
+        results = evaluate_dataset(model_path, image_dir, thresholds, batch_size=batch_size,
+                                   num_workers=num_workers, cache_dir=cache_dir, roc_dir='./',
+                                   tile_size=tile_size, max_side=max_side, results_path=results_path,
+                                   tta_views=tta_views)
+        df_results = pd.DataFrame.from_dict(results, orient='index')
+        df_results.index.name = "Threshold"
+        df_results.columns = ['真阳率(TPR)', '真阴率(TNR)']
+        print(df_results)
+        df_results.to_csv("./results.csv", encoding="utf-8-sig")
+    except ValueError as e:
+        print(f"Error: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
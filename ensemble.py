@@ -0,0 +1,141 @@
+import cv2
+import numpy as np
+
+from box_ops import weighted_box_fusion
+from detection_cache import DetectionCache
+from end_for_testdatasets import LazyModel, boxes_to_array, cache_tag, classify_detections, detect_batches, options_tag
+from instrumentation import metrics
+
+# 增强视图 (是否水平翻转, 输入尺寸)，输入尺寸为 None 时使用模型默认尺寸
+DEFAULT_TTA_VIEWS = ((False, None), (True, None), (False, 800))
+
+
+def view_tag(view):
+    """视图对应的检测缓存 tag；原图视图为空字符串，与普通推理共用缓存"""
+    flip, imgsz = view
+    return "" if not flip and imgsz is None else f"tta=flip{int(flip)},imgsz{imgsz}"
+
+
+class ViewRunner:
+    """
+    包装单个模型，一次调用完成一批图片的全部增强视图：相同输入尺寸的视图（原图与翻转图）合并为一批推理，
+    翻转视图的检测框映射回原图坐标；每张图片返回 (N, 7) 数组，最后一列为视图序号
+    """
+
+    def __init__(self, model, views):
+        self.model = model
+        self.views = list(views)
+
+    def __call__(self, imgs, *args, **kwargs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        parts = [[] for _ in imgs]
+        for imgsz in dict.fromkeys(imgsz for _, imgsz in self.views):
+            batch, owners = [], []
+            for view_id, (flip, view_imgsz) in enumerate(self.views):
+                if view_imgsz != imgsz:
+                    continue
+                for i, img in enumerate(imgs):
+                    batch.append(cv2.flip(img, 1) if flip else img)
+                    owners.append((i, view_id, flip))
+            results = self.model(batch, imgsz=imgsz) if imgsz else self.model(batch)
+            for (i, view_id, flip), result in zip(owners, results):
+                pred = np.array(boxes_to_array(result), dtype=np.float32).reshape(-1, 6)
+                if flip:
+                    width = imgs[i].shape[1]
+                    pred[:, [0, 2]] = width - pred[:, [2, 0]]
+                parts[i].append(np.column_stack([pred, np.full(len(pred), view_id, dtype=np.float32)]))
+        return [np.concatenate(image_parts) for image_parts in parts]
+
+
+class Ensemble:
+    """
+    多模型 + 测试时增强：每个权重文件在每个视图上的原始检测框分别缓存（DetectionCache，tag 区分视图），
+    再用加权框融合（WBF）合并；向集成中新增一个模型时只需运行该模型的推理
+    model_weights: 每个模型的融合权重，默认均为 1
+    min_votes: 融合框至少需要多少个来源（模型 x 视图）检出，默认为来源数的一半（向上取整）；
+    conf_threshold: 融合后置信度的下限。fit/unfit 按检测框数量判定，只被个别视图检出的框若不过滤，
+                    集成结果相当于各视图检测框的并集，会增加误检
+    """
+
+    def __init__(self, model_paths, views=DEFAULT_TTA_VIEWS, model_weights=None, iou_threshold=0.55,
+                 skip_threshold=0.0, min_votes=None, conf_threshold=0.25, model_options=None):
+        self.model_paths = list(model_paths)
+        self.views = list(views)
+        self.model_weights = list(model_weights) if model_weights else [1.0] * len(self.model_paths)
+        self.iou_threshold = iou_threshold
+        self.skip_threshold = skip_threshold
+        num_sources = len(self.model_paths) * len(self.views)
+        self.min_votes = min_votes if min_votes is not None else (num_sources + 1) // 2
+        self.conf_threshold = conf_threshold
+        if len(self.model_weights) != len(self.model_paths):
+            raise ValueError("model_weights must have one weight per model")
+        self.models = [LazyModel(model_path, **(model_options or {})) for model_path in self.model_paths]
+        self.options_tag = options_tag(model_options)
+
+    def _model_views(self, model_index, img_paths, batch_size, num_workers, queue_depth, cache_dir):
+        """单个模型在全部视图上的检测结果 {路径: [各视图 (N, 6)]}，读取失败的图片为 None"""
+        model_path = self.model_paths[model_index]
+        caches = None
+        if cache_dir:
+            caches = [DetectionCache(cache_dir, model_path, tag=cache_tag(view_tag(view), self.options_tag))
+                      for view in self.views]
+        per_image = {}
+        misses = []
+        for img_path in img_paths:
+            cached = [cache.get(img_path) for cache in caches] if caches else [None]
+            if any(pred is None for pred in cached):
+                misses.append(img_path)
+            else:
+                per_image[img_path] = cached
+        metrics.count("cache_hits", len(img_paths) - len(misses))
+        metrics.count("cache_misses", len(misses))
+
+        runner = ViewRunner(self.models[model_index], self.views)
+        for img_path, packed in detect_batches(runner, misses, batch_size=batch_size, num_workers=num_workers,
+                                               queue_depth=queue_depth):
+            if packed is None:
+                per_image[img_path] = None
+                continue
+            views = [packed[packed[:, 6] == view_id, :6] for view_id in range(len(self.views))]
+            per_image[img_path] = views
+            if caches:
+                for cache, pred in zip(caches, views):
+                    cache.put(img_path, pred)
+        if caches:
+            for cache in caches:
+                cache.save_index()
+            print(f"{model_path}: 检测缓存命中 {len(img_paths) - len(misses)} 张，推理 {len(misses)} 张。")
+        return per_image
+
+    def fuse(self, view_preds):
+        """融合 [模型][视图] 的检测框列表，每个视图的权重为所属模型的权重；只保留足够多来源检出且置信度达标的框"""
+        preds, weights = [], []
+        for model_weight, views in zip(self.model_weights, view_preds):
+            preds.extend(views)
+            weights.extend([model_weight] * len(views))
+        with metrics.stage("postprocess"):
+            fused = weighted_box_fusion(preds, weights, self.iou_threshold, self.skip_threshold, self.min_votes)
+        return fused[fused[:, 4] >= self.conf_threshold]
+
+    def detect(self, img_paths, batch_size=8, num_workers=4, queue_depth=16, cache_dir=None):
+        """
+        返回 {图片路径: 融合后的 (N, 6) 检测框数组}，读取失败的图片对应 None
+        batch_size 为每批原图数量，实际送入模型的批次还包含其增强视图
+        """
+        per_model = [self._model_views(i, img_paths, batch_size, num_workers, queue_depth, cache_dir)
+                     for i in range(len(self.models))]
+        detections = {}
+        for img_path in img_paths:
+            view_preds = [model_views.get(img_path) for model_views in per_model]
+            detections[img_path] = None if any(views is None for views in view_preds) else self.fuse(view_preds)
+        return detections
+
+
+def detect_and_classify_ensemble(ensemble, img_path, thresholds, cache_dir=None):
+    """集成版 detect_and_classify：融合全部模型与视图的检测结果后按阈值判定 fit/unfit"""
+    pred = ensemble.detect([img_path], batch_size=1, num_workers=1, cache_dir=cache_dir)[img_path]
+    if pred is None:
+        print(f"Error: Unable to load image {img_path}")
+        return {}
+    return classify_detections(pred, thresholds)
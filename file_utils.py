@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from instrumentation import metrics
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def path_sha256(path, file_hash=file_sha256):
+    """
+    文件或目录的内容哈希：文件直接使用 file_hash；目录（如 OpenVINO 模型目录）按其中全部文件的相对路径与
+    file_hash 计算，任一文件变化都会改变结果
+    """
+    if not os.path.isdir(path):
+        return file_hash(path)
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).replace(os.sep, '/').encode('utf-8') + b'\0')
+            digest.update(file_hash(file_path).encode('ascii'))
+    return digest.hexdigest()
+
+
+def load_json(path, default=None):
+    """读取 JSON 文件，文件不存在或损坏时返回 default"""
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"警告: {path} 损坏，将重新生成。")
+        return default
+
+
+def save_json(path, data):
+    """
+    原子地写入 JSON 文件（先写临时文件再替换，避免中断留下半个文件）
+    临时文件名唯一，多个进程（或多台机器通过共享目录）同时写同一个文件时互不干扰，最后一次写入生效
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        os.chmod(tmp_path, 0o644)  # mkstemp 创建的文件只有所有者可读，恢复普通文件的权限
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+LINK_MODES = ("copy", "hardlink", "symlink")
+
+
+def link_or_copy(src, dst, mode="copy"):
+    """
+    按 mode 将 src 放置到 dst：copy 复制（保留修改时间）、hardlink 硬链接、symlink 软链接
+    链接失败（如跨文件系统、无权限）时退回复制，返回实际使用的方式
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    elif mode == "symlink":
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def is_up_to_date(src, dst, mode="copy"):
+    """判断 dst 是否已是 src 的链接或相同副本（同一 inode，或大小与修改时间一致）"""
+    if os.path.islink(dst):
+        return mode == "symlink" and os.readlink(dst) == os.path.abspath(src)
+    if not os.path.exists(dst):
+        return False
+    src_stat = os.stat(src)
+    dst_stat = os.stat(dst)
+    if src_stat.st_ino == dst_stat.st_ino and src_stat.st_dev == dst_stat.st_dev:
+        return True
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def sync_directory(target_dir, sources, mode="copy"):
+    """
+    使 target_dir 的内容与 sources {文件名: 源路径} 一致：只放置缺失或已变化的文件，删除多余的文件
+    返回 (新增或更新数, 删除数, 未变化数)
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    removed = 0
+    added = 0
+    with metrics.stage("file_io"):
+        for name in os.listdir(target_dir):
+            if name not in sources:
+                path = os.path.join(target_dir, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+                removed += 1
+
+        for name, src in sources.items():
+            dst = os.path.join(target_dir, name)
+            if not is_up_to_date(src, dst, mode):
+                link_or_copy(src, dst, mode)
+                added += 1
+    metrics.count("files_placed", added)
+    metrics.count("files_removed", removed)
+    return added, removed, len(sources) - added
+
+
+def _place_one(src, dst, mode):
+    if is_up_to_date(src, dst, mode):
+        return "skipped"
+    link_or_copy(src, dst, mode)
+    return "placed"
+
+
+def place_files(pairs, mode="copy", num_workers=8, desc="Copying files"):
+    """
+    用线程池并发放置 [(源路径, 目标路径)]：大小与修改时间一致（或已是同一文件）的目标直接跳过
+    mode 同 link_or_copy；只显示一个进度条，结束后返回 {"placed": n, "skipped": n, "failed": [(源路径, 错误)]}
+    """
+    summary = {"placed": 0, "skipped": 0, "failed": []}
+    with metrics.stage("file_io"), ThreadPoolExecutor(max_workers=num_workers) as executor, \
+            tqdm(total=len(pairs), desc=desc) as progress:
+        futures = {executor.submit(_place_one, src, dst, mode): src for src, dst in pairs}
+        for future in as_completed(futures):
+            try:
+                summary[future.result()] += 1
+            except Exception as e:
+                summary["failed"].append((futures[future], e))
+            progress.update()
+    metrics.count("files_placed", summary["placed"])
+    return summary
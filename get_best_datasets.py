@@ -1,105 +1,259 @@
-import os
-import shutil
-import re
-import argparse
-from pathlib import Path
-
-import re
-
-def find_images_with_detections(yolo_output_file, min_detections=5):
-    """从YOLOv8输出文件中找出检测到目标框数量超过阈值的图片索引。"""
-    indices = []
-    try:
-        with open(yolo_output_file, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f):
-                # 更健壮的正则表达式，处理只有一种检测框的情况
-                match = re.match(r"^0: \d+x\d+ (?:(\d+) (lows?|normals?), )?(?:(\d+) (lows?|normals?), )?.*", line)
-                if match:
-                    counts = {}
-                    for j in range(0, 4, 2):  # 遍历匹配到的所有数量和类型
-                        count_str = match.group(j + 1)
-                        type_str = match.group(j + 2)
-                        if count_str and type_str:
-                            counts[type_str] = int(count_str)
-                    total_count = sum(counts.values())
-                    if total_count > min_detections:
-                        indices.append(i)
-                elif "(no detections)" in line:
-                    continue  # 跳过没有检测到的行
-                else:
-                    print(f"警告: 第 {i+1} 行格式不匹配: {line.strip()}")  # 输出不匹配的行，方便调试
-    except FileNotFoundError:
-        print(f"错误：找不到YOLO输出文件：{yolo_output_file}")
-        return []
-    except Exception as e:
-        print(f"读取YOLO输出文件时发生错误：{e}")
-        return []
-    return indices
-
-def copy_images(image_directory, output_image_directory, label_directory, output_label_directory, indices):
-    """根据索引列表复制图片和标签到各自的输出目录。"""
-
-    output_image_path = Path(output_image_directory)
-    output_image_path.mkdir(parents=True, exist_ok=True)
-
-    output_label_path = Path(output_label_directory) #创建标签输出目录
-    output_label_path.mkdir(parents=True, exist_ok=True)
-
-    image_path = Path(image_directory)
-    label_path = Path(label_directory)
-
-    try:
-        image_files = sorted([f.name for f in image_path.iterdir() if f.is_file()])
-        image_index_map = dict(enumerate(image_files))
-
-        label_files = sorted([f.name for f in label_path.iterdir() if f.is_file()])
-        label_index_map = dict(enumerate(label_files))
-
-        if len(image_files) != len(label_files):
-            print("警告：图片文件数量和标签文件数量不一致，可能导致索引错误。")
-
-    except FileNotFoundError:
-        print(f"错误：找不到图片或标签目录。")
-        return
-    except Exception as e:
-        print(f"读取图片或标签目录时发生错误：{e}")
-        return
-
-    for index in indices:
-        if index in image_index_map and index in label_index_map:
-            source_image = image_path / image_index_map[index]
-            dest_image = output_image_path / image_index_map[index]
-
-            source_label = label_path / label_index_map[index]
-            dest_label = output_label_path / label_index_map[index] #使用标签输出路径
-
-            try:
-                shutil.copy2(source_image, dest_image)
-                print(f"复制图片：{source_image} 到 {dest_image}")
-
-                shutil.copy2(source_label, dest_label)
-                print(f"复制标签：{source_label} 到 {dest_label}")
-
-            except Exception as e:
-                print(f"复制文件时发生错误：{e}")
-        else:
-            print(f"警告：索引 {index} 超出图片或标签范围。可用索引范围为 0 到 {min(len(image_index_map), len(label_index_map)) - 1}")
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="从YOLOv8输出中提取检测框数量大于指定值的图片和标签。")
-    parser.add_argument("yolo_output", nargs='?', default='./pred_out.txt', help="YOLOv8输出文件路径")
-    parser.add_argument("image_dir", nargs='?', default='./datasets/data/train/train', help="原始图片目录")
-    parser.add_argument("label_dir", nargs='?', default='./datasets/data/train/train', help="原始标签目录")
-    parser.add_argument("-oi", "--output_image_dir", default="./batter_datasets/batter_data/train", help="输出图片目录") #添加图片输出目录参数
-    parser.add_argument("-ol", "--output_label_dir", default="./batter_datasets/batter_data/train", help="输出标签目录") #添加标签输出目录参数
-    parser.add_argument("-m", "--min_detections", type=int, default=5, help="最小检测框数量")
-    args = parser.parse_args()
-
-    indices = find_images_with_detections(args.yolo_output, args.min_detections)
-    if indices:
-        print(f"检测框数量大于 {args.min_detections} 的图片索引: {indices}")
-        copy_images(args.image_dir, args.output_image_dir, args.label_dir, args.output_label_dir, indices) #传递标签输出目录参数
-        print("complete!")
-    else:
-        print("can not find effective imgs or Yolo output file format error")
\ No newline at end of file
+import os
+import re
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from annotation_index import CLASS_NAMES
+from file_utils import path_sha256, place_files
+from instrumentation import get_logger, metrics
+
+import re
+
+logger = get_logger(__name__)
+
+def find_images_with_detections(yolo_output_file, min_detections=5):
+    """从YOLOv8输出文件中找出检测到目标框数量超过阈值的图片索引。"""
+    indices = []
+    try:
+        with metrics.stage("parse_log"), open(yolo_output_file, 'r', encoding='utf-8') as f:
+            for i, line in enumerate(f):
+                # 更健壮的正则表达式，处理只有一种检测框的情况
+                match = re.match(r"^0: \d+x\d+ (?:(\d+) (lows?|normals?), )?(?:(\d+) (lows?|normals?), )?.*", line)
+                if match:
+                    counts = {}
+                    for j in range(0, 4, 2):  # 遍历匹配到的所有数量和类型
+                        count_str = match.group(j + 1)
+                        type_str = match.group(j + 2)
+                        if count_str and type_str:
+                            counts[type_str] = int(count_str)
+                    total_count = sum(counts.values())
+                    if total_count > min_detections:
+                        indices.append(i)
+                elif "(no detections)" in line:
+                    continue  # 跳过没有检测到的行
+                else:
+                    logger.warning("警告: 第 %d 行格式不匹配: %s", i + 1, line.strip())  # 输出不匹配的行，方便调试
+    except FileNotFoundError:
+        print(f"错误：找不到YOLO输出文件：{yolo_output_file}")
+        return []
+    except Exception as e:
+        print(f"读取YOLO输出文件时发生错误：{e}")
+        return []
+    return indices
+
+def report_copy_summary(summary):
+    """打印复制结果汇总"""
+    print(f"复制完成：新增 {summary['placed']} 个文件，跳过未变化文件 {summary['skipped']} 个，失败 {len(summary['failed'])} 个")
+    for source, error in summary["failed"]:
+        print(f"复制文件时发生错误：{source}: {error}")
+
+
+def copy_images(image_directory, output_image_directory, label_directory, output_label_directory, indices,
+                num_workers=8, mode="copy"):
+    """
+    根据索引列表复制图片和标签到各自的输出目录。
+    num_workers: 并发复制线程数；mode: "copy" 复制或 "hardlink" 硬链接（失败时退回复制）
+    """
+
+    output_image_path = Path(output_image_directory)
+    output_image_path.mkdir(parents=True, exist_ok=True)
+
+    output_label_path = Path(output_label_directory) #创建标签输出目录
+    output_label_path.mkdir(parents=True, exist_ok=True)
+
+    image_path = Path(image_directory)
+    label_path = Path(label_directory)
+
+    try:
+        image_files = sorted([f.name for f in image_path.iterdir() if f.is_file()])
+        image_index_map = dict(enumerate(image_files))
+
+        label_files = sorted([f.name for f in label_path.iterdir() if f.is_file()])
+        label_index_map = dict(enumerate(label_files))
+
+        if len(image_files) != len(label_files):
+            print("警告：图片文件数量和标签文件数量不一致，可能导致索引错误。")
+
+    except FileNotFoundError:
+        print(f"错误：找不到图片或标签目录。")
+        return
+    except Exception as e:
+        print(f"读取图片或标签目录时发生错误：{e}")
+        return
+
+    pairs = []
+    out_of_range = []
+    for index in indices:
+        if index in image_index_map and index in label_index_map:
+            pairs.append((image_path / image_index_map[index], output_image_path / image_index_map[index]))
+            pairs.append((label_path / label_index_map[index], output_label_path / label_index_map[index])) #使用标签输出路径
+        else:
+            out_of_range.append(index)
+    if out_of_range:
+        print(f"警告：{len(out_of_range)} 个索引超出图片或标签范围（如 {out_of_range[:5]}）。可用索引范围为 0 到 {min(len(image_index_map), len(label_index_map)) - 1}")
+
+    report_copy_summary(place_files(pairs, mode=mode, num_workers=num_workers))
+
+
+COUNT_COLUMNS = [f"n_{name.lower().replace(' ', '_')}" for name in CLASS_NAMES]
+TABLE_META = ("image_dir", "model_path", "model_hash")  # 记录检测记录表的来源，读取时核对
+
+
+def list_images(image_dir):
+    return sorted(f for f in os.listdir(image_dir) if f.endswith(('.jpg', '.png')))
+
+
+def build_detection_table(model_path, image_dir, batch_size=8, cache_dir=None):
+    """
+    直接运行（或读取缓存的）检测，得到每张图片一行的结构化记录：
+    filename、各类别检测框数量、检测框总数以及置信度的均值 / 最小值 / 最大值
+    table.attrs 记录图片目录、模型路径与模型哈希
+    """
+    from end_for_testdatasets import collect_detections  # 只有需要推理时才导入检测模型相关依赖
+
+    image_files = list_images(image_dir)
+    img_paths = [os.path.join(image_dir, f) for f in image_files]
+    detections = collect_detections(model_path, img_paths, batch_size=batch_size, cache_dir=cache_dir)
+
+    counts = np.zeros((len(img_paths), len(CLASS_NAMES)), dtype=np.int32)
+    conf_stats = np.full((len(img_paths), 3), np.nan, dtype=np.float32)
+    for i, img_path in enumerate(img_paths):
+        pred = detections.get(img_path)
+        if pred is None or pred.size == 0:
+            continue
+        counts[i] = np.bincount(pred[:, 5].astype(int), minlength=len(CLASS_NAMES))[:len(CLASS_NAMES)]
+        conf_stats[i] = pred[:, 4].mean(), pred[:, 4].min(), pred[:, 4].max()
+
+    table = pd.DataFrame(counts, columns=COUNT_COLUMNS)
+    table.insert(0, "filename", image_files)
+    table["n_total"] = counts.sum(axis=1)
+    table["conf_mean"], table["conf_min"], table["conf_max"] = conf_stats.T
+    table.attrs = {"image_dir": os.path.abspath(image_dir), "model_path": model_path,
+                   "model_hash": path_sha256(model_path)}
+    return table
+
+
+def save_detection_table(table, table_path):
+    """保存检测记录表：.parquet 使用 Parquet 列式格式，其他后缀保存为 NumPy .npz"""
+    if table_path.endswith(".parquet"):
+        table.to_parquet(table_path, index=False)
+    else:
+        # 文件名列保存为定长 Unicode 数组，读取时无需 pickle；来源信息保存为 meta_ 开头的字符串
+        np.savez(table_path, **{column: table[column].to_numpy(dtype=str if column == "filename" else None)
+                                for column in table.columns},
+                 **{f"meta_{key}": np.asarray(table.attrs.get(key, "")) for key in TABLE_META})
+
+
+def load_detection_table(table_path):
+    """读取 save_detection_table 保存的检测记录表（来源信息在 table.attrs 中）"""
+    if table_path.endswith(".parquet"):
+        return pd.read_parquet(table_path)
+    with np.load(table_path, allow_pickle=False) as data:
+        columns = [key for key in data.files if not key.startswith("meta_")]
+        table = pd.DataFrame({column: data[column] for column in columns})
+        table.attrs = {key[len("meta_"):]: str(data[key]) for key in data.files if key.startswith("meta_")}
+    return table
+
+
+def table_mismatch(table, image_dir, model_path=None):
+    """
+    核对检测记录表是否由 image_dir 当前的图片（以及指定的 model_path）生成，
+    一致时返回 None，否则返回原因
+    """
+    if not table.attrs.get("image_dir"):
+        return "没有记录来源（旧版本生成）"
+    if table.attrs["image_dir"] != os.path.abspath(image_dir):
+        return f"由其他图片目录 {table.attrs['image_dir']} 生成"
+    if table["filename"].tolist() != list_images(image_dir):
+        return "生成后图片目录内容已变化"
+    if model_path is not None and table.attrs.get("model_hash") != path_sha256(model_path):
+        return f"由其他模型 {table.attrs.get('model_path')} 生成"
+    return None
+
+
+def select_images(table, min_detections=5, class_name=None, min_conf=None):
+    """
+    向量化筛选图片，返回文件名列表
+    min_detections: 检测框数量需大于该值；class_name 指定时只统计该类别，否则统计全部类别
+    min_conf: 检测框平均置信度的下限
+    """
+    column = COUNT_COLUMNS[CLASS_NAMES.index(class_name)] if class_name else "n_total"
+    mask = table[column].to_numpy() > min_detections
+    if min_conf is not None:
+        mask &= table["conf_mean"].to_numpy() >= min_conf
+    return table["filename"].to_numpy()[mask].tolist()
+
+
+def copy_selected(image_directory, output_image_directory, label_directory, output_label_directory, filenames,
+                  num_workers=8, mode="copy"):
+    """按文件名复制图片及同名的 .txt 标签，不依赖目录排序后的索引对齐"""
+    output_image_path = Path(output_image_directory)
+    output_image_path.mkdir(parents=True, exist_ok=True)
+    output_label_path = Path(output_label_directory)
+    output_label_path.mkdir(parents=True, exist_ok=True)
+
+    pairs = []
+    missing_labels = 0
+    for filename in filenames:
+        source_image = Path(image_directory) / filename
+        source_label = Path(label_directory) / (Path(filename).stem + ".txt")
+        pairs.append((source_image, output_image_path / source_image.name))
+        if source_label.exists():
+            pairs.append((source_label, output_label_path / source_label.name))
+        else:
+            missing_labels += 1
+    if missing_labels:
+        print(f"警告：{missing_labels} 张图片找不到对应的标签文件")
+
+    report_copy_summary(place_files(pairs, mode=mode, num_workers=num_workers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从YOLOv8输出中提取检测框数量大于指定值的图片和标签。")
+    parser.add_argument("yolo_output", nargs='?', default='./pred_out.txt', help="YOLOv8输出文件路径")
+    parser.add_argument("image_dir", nargs='?', default='./datasets/data/train/train', help="原始图片目录")
+    parser.add_argument("label_dir", nargs='?', default='./datasets/data/train/train', help="原始标签目录")
+    parser.add_argument("-oi", "--output_image_dir", default="./batter_datasets/batter_data/train", help="输出图片目录") #添加图片输出目录参数
+    parser.add_argument("-ol", "--output_label_dir", default="./batter_datasets/batter_data/train", help="输出标签目录") #添加标签输出目录参数
+    parser.add_argument("-m", "--min_detections", type=int, default=5, help="最小检测框数量")
+    parser.add_argument("--model", default=None, help="模型权重路径；指定后直接运行检测并生成结构化记录，不再解析YOLO输出文本")
+    parser.add_argument("--table", default=None,
+                        help="结构化检测记录路径（.npz 或 .parquet）：与 --model 同时指定时保存到该路径"
+                             "（默认 ./detections.npz），单独指定时读取该记录，需与图片目录一致")
+    parser.add_argument("--cache_dir", default="./detection_cache", help="检测结果缓存目录")
+    parser.add_argument("--class_name", default=None, choices=CLASS_NAMES, help="只统计指定类别的检测框数量")
+    parser.add_argument("--min_conf", type=float, default=None, help="检测框平均置信度下限")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="并发复制线程数")
+    parser.add_argument("--link", action="store_true", help="使用硬链接代替复制（跨文件系统时自动退回复制）")
+    args = parser.parse_args()
+
+    if args.model or args.table:
+        args.table = args.table or "./detections.npz"
+        table = load_detection_table(args.table) if os.path.exists(args.table) else None
+        problem = table_mismatch(table, args.image_dir, args.model) if table is not None else "不存在"
+        if problem and args.model:
+            print(f"检测记录 {args.table} {problem}，重新运行检测")
+            table = build_detection_table(args.model, args.image_dir, cache_dir=args.cache_dir)
+            save_detection_table(table, args.table)
+        elif problem:
+            parser.error(f"检测记录 {args.table} {problem}，请用 --model 重新生成")
+        else:
+            print(f"使用检测记录 {args.table}（模型 {table.attrs.get('model_path')}）")
+        filenames = select_images(table, args.min_detections, args.class_name, args.min_conf)
+        print(f"满足条件的图片数量: {len(filenames)} / {len(table)}")
+        if filenames:
+            copy_selected(args.image_dir, args.output_image_dir, args.label_dir, args.output_label_dir, filenames,
+                          num_workers=args.workers, mode="hardlink" if args.link else "copy")
+            print("complete!")
+    else:
+        indices = find_images_with_detections(args.yolo_output, args.min_detections)
+        if indices:
+            print(f"检测框数量大于 {args.min_detections} 的图片索引: {indices}")
+            copy_images(args.image_dir, args.output_image_dir, args.label_dir, args.output_label_dir, indices,
+                        num_workers=args.workers, mode="hardlink" if args.link else "copy") #传递标签输出目录参数
+            print("complete!")
+        else:
+            print("can not find effective imgs or Yolo output file format error")
@@ -0,0 +1,55 @@
+import hashlib
+from collections import defaultdict
+
+
+def stable_fraction(key, salt=""):
+    """根据 key 的稳定哈希得到 [0, 1) 之间的值，与运行环境和随机种子无关"""
+    digest = hashlib.sha1(f"{salt}:{key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def hash_shard(key, num_shards, salt="shard"):
+    """根据 key 的稳定哈希分配分片编号 [0, num_shards)，与列表顺序和其他 key 无关"""
+    return min(int(stable_fraction(key, salt) * num_shards), num_shards - 1)
+
+
+def hash_split(keys, train_ratio=0.9, strata=None, previous=None, salt=""):
+    """
+    确定性地划分训练集与验证集，返回 {key: "train" / "val"}
+    strata: 为 None 时每个 key 按哈希值与 train_ratio 比较独立分配，新增 key 不会影响已有 key；
+            为 {key: 分层标签} 时按层分配：每层内按哈希值顺序，把 key 放入当前离目标比例差距更大的一方，
+            使每层的 train/val 比例都接近 train_ratio
+    previous: 之前的划分结果 {key: split}，仍然存在的 key 保持原划分，只分配新增的 key
+              （分层模式下需要传入 previous 才能保证新增样本不会移动已有样本）
+    """
+    previous = previous or {}
+    assignment = {}
+    new_keys = []
+    for key in keys:
+        if previous.get(key) in ("train", "val"):
+            assignment[key] = previous[key]
+        else:
+            new_keys.append(key)
+
+    if strata is None:
+        for key in new_keys:
+            assignment[key] = "train" if stable_fraction(key, salt) < train_ratio else "val"
+        return assignment
+
+    # 统计每层已有的划分数量
+    train_counts = defaultdict(int)
+    totals = defaultdict(int)
+    for key, split in assignment.items():
+        totals[strata[key]] += 1
+        train_counts[strata[key]] += split == "train"
+
+    for key in sorted(new_keys, key=lambda k: (stable_fraction(k, salt), k)):
+        stratum = strata[key]
+        totals[stratum] += 1
+        # 放入 train 后该层的 train 数量是否仍不超过目标数量
+        if train_counts[stratum] + 1 <= round(totals[stratum] * train_ratio):
+            assignment[key] = "train"
+            train_counts[stratum] += 1
+        else:
+            assignment[key] = "val"
+    return assignment
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import atexit
+import logging
+import cProfile
+import threading
+import multiprocessing
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 通过环境变量控制，无需修改代码：
+#   NAIL_LOG_LEVEL       日志级别（DEBUG 时输出逐框 / 逐图片的调试信息），默认 INFO
+#   NAIL_METRICS_FILE    进程退出时写出指标，.prom 后缀为 Prometheus 文本格式，否则为 JSON；
+#                        子进程（如 sharded_eval / sweep 的工作进程）写入带进程号的同名文件，如 metrics.12345.json
+#   NAIL_PROFILE_STAGES  需要挂载分析器的阶段名，逗号分隔，如 "inference,crop"
+#   NAIL_PROFILER        cprofile（默认）或 pyinstrument（采样分析器，需要单独安装）
+#   NAIL_PROFILE_DIR     分析结果输出目录，默认 ./profiles
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def per_process_path(path):
+    """主进程直接使用 path；子进程在扩展名前加上进程号，避免多个进程覆盖同一个文件"""
+    if multiprocessing.parent_process() is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def get_logger(name):
+    """返回模块日志器，首次调用时按 NAIL_LOG_LEVEL 配置输出格式与级别"""
+    root = logging.getLogger()
+    if not root.handlers:
+        logging.basicConfig(level=os.environ.get("NAIL_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    return logging.getLogger(name)
+
+
+class Histogram:
+    """固定分桶的直方图，同时记录数量、总和、最小值与最大值"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0,
+                "min": self.min if self.count else 0, "max": self.max if self.count else 0}
+
+
+class Metrics:
+    """
+    线程安全的指标记录：按阶段计时（stage 上下文管理器）、计数器与直方图，
+    可导出为 JSON 或 Prometheus 文本格式，并可按 NAIL_PROFILE_STAGES 为指定阶段挂载分析器
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = {}
+        self.counters = {}
+        self.histograms = {}
+        self.profile_stages = {s for s in os.environ.get("NAIL_PROFILE_STAGES", "").split(",") if s}
+        self.profiler_kind = os.environ.get("NAIL_PROFILER", "cprofile")
+        self._profilers = {}
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时；该阶段在 NAIL_PROFILE_STAGES 中且位于主线程时同时运行分析器"""
+        profiler = self._start_profiler(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                self._stop_profiler(profiler)
+            with self._lock:
+                self.stage_seconds.setdefault(name, Histogram()).observe(elapsed)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram(buckets)).observe(value)
+
+    def reset(self):
+        """清空已记录的计时、计数器与直方图"""
+        with self._lock:
+            self.stage_seconds.clear()
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _start_profiler(self, name):
+        if name not in self.profile_stages or threading.current_thread() is not threading.main_thread():
+            return None
+        if name not in self._profilers:
+            if self.profiler_kind == "pyinstrument":
+                from pyinstrument import Profiler
+                self._profilers[name] = Profiler()
+            else:
+                self._profilers[name] = cProfile.Profile()
+        profiler = self._profilers[name]
+        if self.profiler_kind == "pyinstrument":
+            profiler.start()
+        else:
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler):
+        if self.profiler_kind == "pyinstrument":
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def save_profiles(self, profile_dir=None):
+        """保存各阶段的分析结果：cProfile 为 <阶段>.prof（可用 snakeviz / pstats 查看），pyinstrument 为 HTML"""
+        if not self._profilers:
+            return
+        profile_dir = profile_dir or os.environ.get("NAIL_PROFILE_DIR", "./profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        for name, profiler in self._profilers.items():
+            if self.profiler_kind == "pyinstrument":
+                with open(per_process_path(os.path.join(profile_dir, f"{name}.html")), 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.dump_stats(per_process_path(os.path.join(profile_dir, f"{name}.prof")))
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "stages": {name: h.to_dict() for name, h in self.stage_seconds.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="nail"):
+        """导出为 Prometheus 文本格式"""
+        lines = []
+
+        def histogram_lines(metric, histogram, labels=""):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.bucket_counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{metric}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+            lines.append(f"{metric}_count{suffix} {histogram.count}")
+
+        with self._lock:
+            if self.stage_seconds:
+                lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+                for name, histogram in self.stage_seconds.items():
+                    histogram_lines(f"{prefix}_stage_seconds", histogram, f'stage="{name}"')
+            for name, value in self.counters.items():
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            for name, histogram in self.histograms.items():
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                histogram_lines(f"{prefix}_{name}", histogram)
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        """按后缀写出指标：.prom 为 Prometheus 文本格式，其他为 JSON"""
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+metrics = Metrics()
+
+
+@atexit.register
+def _dump_at_exit():
+    metrics.save_profiles()
+    if os.environ.get("NAIL_METRICS_FILE") and any(metrics.to_dict().values()):
+        # 每个进程写自己的文件；没有记录任何指标的进程（如只负责调度的父进程）不写
+        metrics.save(per_process_path(os.environ["NAIL_METRICS_FILE"]))
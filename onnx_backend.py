@@ -0,0 +1,184 @@
+import os
+import argparse
+import cv2
+import numpy as np
+
+from box_ops import letterbox, nms, xywh_to_xyxy
+from hash_split import stable_fraction
+from threshold_metrics import normal_ratio
+
+
+def export_onnx(model_path, imgsz=640, output_path=None):
+    """将 Ultralytics 权重 (.pt) 导出为 ONNX（动态 batch），返回 ONNX 文件路径"""
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    if output_path and os.path.abspath(output_path) != os.path.abspath(exported):
+        os.replace(exported, output_path)
+        return output_path
+    return exported
+
+
+def export_openvino(model_path, imgsz=640, int8=False, calibration_data=None):
+    """导出为 OpenVINO 模型目录（可选 INT8），导出的目录可直接作为 evaluate_dataset 的 model_path"""
+    from ultralytics import YOLO
+
+    return YOLO(model_path).export(format="openvino", imgsz=imgsz, int8=int8, data=calibration_data)
+
+
+def preprocess(imgs, imgsz=640):
+    """BGR 图片列表 -> (B, 3, imgsz, imgsz) float32 输入张量，以及每张图片的缩放比例与填充量"""
+    batch = np.empty((len(imgs), 3, imgsz, imgsz), dtype=np.float32)
+    transforms = []
+    for i, img in enumerate(imgs):
+        padded, ratio, pad = letterbox(img, imgsz)
+        batch[i] = padded[:, :, ::-1].transpose(2, 0, 1) / 255.0
+        transforms.append((ratio, pad, img.shape[:2]))
+    return batch, transforms
+
+
+def postprocess(output, transforms, conf_threshold=0.25, iou_threshold=0.7, max_det=300):
+    """
+    解析 YOLOv8 ONNX 输出 (B, 4 + 类别数, 锚点数)，返回每张图片原图坐标下的 (N, 6) 检测框数组
+    置信度过滤与按类别 NMS 的默认参数与 Ultralytics predict 相同
+    """
+    preds = []
+    for raw, (ratio, (left, top), (height, width)) in zip(output, transforms):
+        raw = raw.T  # (锚点数, 4 + 类别数)
+        scores = raw[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), class_ids]
+        keep = confs >= conf_threshold
+        if not keep.any():
+            preds.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+        boxes = xywh_to_xyxy(raw[keep, :4])
+        pred = np.concatenate([boxes, confs[keep, None], class_ids[keep, None]], axis=1).astype(np.float32)
+        pred = nms(pred, iou_threshold, metric="iou")[:max_det]
+        pred[:, [0, 2]] = ((pred[:, [0, 2]] - left) / ratio).clip(0, width)
+        pred[:, [1, 3]] = ((pred[:, [1, 3]] - top) / ratio).clip(0, height)
+        preds.append(pred)
+    return preds
+
+
+class OnnxDetector:
+    """
+    基于 ONNX Runtime 的 CPU 检测器，不依赖 torch / ultralytics
+    调用方式与 YOLO 模型相同：传入一张或一批 BGR 图片，返回每张图片的 (N, 6) 检测框数组
+    intra_op_threads / inter_op_threads: ONNX Runtime 的算子内 / 算子间线程数，默认由 ONNX Runtime 决定
+    providers: 执行后端，安装 onnxruntime-openvino 后可使用 ["OpenVINOExecutionProvider"]
+    """
+
+    def __init__(self, onnx_path, imgsz=640, conf_threshold=0.25, iou_threshold=0.7, intra_op_threads=None,
+                 inter_op_threads=None, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options,
+                                            providers=providers or ["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+
+    def __call__(self, imgs, imgsz=None):
+        """imgsz: 本次推理的输入尺寸（需导出为动态尺寸的模型），默认使用构造时的 imgsz"""
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        batch, transforms = preprocess(imgs, imgsz or self.imgsz)
+        output = self.session.run(None, {self.input_name: batch})[0]
+        return postprocess(output, transforms, self.conf_threshold, self.iou_threshold)
+
+
+def sample_calibration_images(image_dir, num_images=100):
+    """按文件名的稳定哈希从训练图片中抽取校准集，每次运行抽到的图片相同"""
+    image_files = [f for f in os.listdir(image_dir) if f.endswith(('.jpg', '.png'))]
+    image_files.sort(key=stable_fraction)
+    return [os.path.join(image_dir, f) for f in image_files[:num_images]]
+
+
+def quantize_int8(onnx_path, calibration_dir, output_path=None, num_images=100, imgsz=640):
+    """使用训练图片作为校准集，对 ONNX 模型做静态 INT8 量化，返回量化模型路径"""
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    img_paths = sample_calibration_images(calibration_dir, num_images)
+
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(img_paths)
+
+        def get_next(self):
+            for img_path in self.paths:
+                img = cv2.imread(img_path)
+                if img is not None:
+                    return {input_name: preprocess([img], imgsz)[0]}
+            return None
+
+    output_path = output_path or os.path.splitext(onnx_path)[0] + "_int8.onnx"
+    quantize_static(onnx_path, output_path, ImageReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    return output_path
+
+
+def check_parity(model_path, onnx_path, image_dir, num_images=50, imgsz=640):
+    """
+    对比 PyTorch 与 ONNX 的检测结果：每张图片的检测框数量、normal 占比，以及按类别 IoU 匹配后的最大坐标偏差
+    返回汇总字典
+    """
+    from ultralytics import YOLO
+    from end_for_testdatasets import boxes_to_array
+
+    torch_model = YOLO(model_path)
+    onnx_model = OnnxDetector(onnx_path, imgsz=imgsz)
+    img_paths = sample_calibration_images(image_dir, num_images)
+
+    same_count = same_ratio = compared = 0
+    max_shift = 0.0
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        compared += 1
+        torch_pred = boxes_to_array(torch_model(img, imgsz=imgsz, verbose=False)[0])
+        onnx_pred = onnx_model(img)[0]
+        same_count += len(torch_pred) == len(onnx_pred)
+        same_ratio += normal_ratio(torch_pred) == normal_ratio(onnx_pred)
+        for box in torch_pred:
+            candidates = onnx_pred[onnx_pred[:, 5] == box[5]] if len(onnx_pred) else onnx_pred
+            if len(candidates):
+                max_shift = max(max_shift, float(np.abs(candidates[:, :4] - box[:4]).max(axis=1).min()))
+
+    summary = {
+        "images": compared,
+        "same box count": same_count / compared if compared else 0,
+        "same normal ratio": same_ratio / compared if compared else 0,
+        "max box shift (px)": max_shift,
+    }
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将 YOLO 权重导出为 ONNX（可选 INT8 量化）并检查与 PyTorch 的一致性。")
+    parser.add_argument("model", nargs='?', default='./runs/train/custom_experiment_8s_0902_0.001_20018/weights/best.pt',
+                        help="PyTorch 权重路径")
+    parser.add_argument("--imgsz", type=int, default=640, help="模型输入尺寸")
+    parser.add_argument("--int8", action="store_true", help="导出后做静态 INT8 量化")
+    parser.add_argument("--calib_dir", default='./datasets/data/images/train', help="INT8 校准图片目录（训练集图片）")
+    parser.add_argument("--parity_dir", default='./TestDatasets', help="一致性检查使用的图片目录")
+    args = parser.parse_args()
+
+    onnx_path = export_onnx(args.model, imgsz=args.imgsz)
+    print(f"ONNX 模型: {onnx_path}")
+    if args.int8:
+        onnx_path = quantize_int8(onnx_path, args.calib_dir, imgsz=args.imgsz)
+        print(f"INT8 模型: {onnx_path}")
+    check_parity(args.model, onnx_path, args.parity_dir, imgsz=args.imgsz)
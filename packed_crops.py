@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import numpy as np
+
+INDEX_NAME = 'index.npz'
+SHARD_PATTERN = 'shard_{:05d}.npy'
+
+
+class PackedCropWriter:
+    """
+    将一个划分（train / val）的全部裁剪图写入分片打包文件：
+    <output_dir>/<split>/shard_00000.npy ... 每个分片是 (最多 shard_size, crop_size, crop_size, 3) 的 RGB uint8 数组，
+    index.npz 记录每个样本的名称与类别 id；样本 i 位于第 i // shard_size 个分片的第 i % shard_size 行
+    names 预先给定全部样本的顺序，写入顺序任意；index.npz 最后写入，存在即表示打包完整
+    """
+
+    def __init__(self, output_dir, split, names, labels, class_names, crop_size=224, shard_size=4096):
+        self.split_dir = os.path.join(output_dir, split)
+        if os.path.exists(self.split_dir):
+            shutil.rmtree(self.split_dir)
+        os.makedirs(self.split_dir)
+        self.names = list(names)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.class_names = list(class_names)
+        self.crop_size = crop_size
+        self.shard_size = shard_size
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.shards = []
+        for start in range(0, len(self.names), shard_size):
+            rows = min(shard_size, len(self.names) - start)
+            path = os.path.join(self.split_dir, SHARD_PATTERN.format(len(self.shards)))
+            self.shards.append(np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                                         shape=(rows, crop_size, crop_size, 3)))
+
+    def write(self, name, crop):
+        """写入一个 (crop_size, crop_size, 3) uint8 裁剪图"""
+        i = self.rows[name]
+        self.shards[i // self.shard_size][i % self.shard_size] = crop
+
+    def close(self):
+        for shard in self.shards:
+            shard.flush()
+        self.shards = []
+        tmp_path = os.path.join(self.split_dir, INDEX_NAME + '.tmp.npz')
+        np.savez(tmp_path, names=np.asarray(self.names, dtype=str), labels=self.labels,
+                 class_names=np.asarray(self.class_names, dtype=str), crop_size=self.crop_size,
+                 shard_size=self.shard_size)
+        os.replace(tmp_path, os.path.join(self.split_dir, INDEX_NAME))
+
+
+class PackedCropDataset:
+    """
+    读取 PackedCropWriter 的输出：分片以内存映射方式打开（每个进程首次访问时打开，可用于 DataLoader 多进程），
+    dataset[i] 返回 (图片, 类别 id)，图片是分片中的只读视图，不复制数据；transform 可对图片做进一步处理
+    """
+
+    def __init__(self, packed_dir, split, transform=None):
+        self.split_dir = os.path.join(packed_dir, split)
+        with np.load(os.path.join(self.split_dir, INDEX_NAME)) as index:
+            self.names = index['names']
+            self.labels = index['labels'].astype(np.int64)
+            self.class_names = index['class_names'].tolist()
+            self.crop_size = int(index['crop_size'])
+            self.shard_size = int(index['shard_size'])
+        self.transform = transform
+        self._shards = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def shards(self):
+        if self._shards is None or self._pid != os.getpid():
+            num_shards = (len(self.labels) + self.shard_size - 1) // self.shard_size
+            self._shards = [np.load(os.path.join(self.split_dir, SHARD_PATTERN.format(i)), mmap_mode='r')
+                            for i in range(num_shards)]
+            self._pid = os.getpid()
+        return self._shards
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        img = self.shards[i // self.shard_size][i % self.shard_size]
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.labels[i]
+
+    def iter_batches(self, batch_size=256, shuffle=False, seed=None):
+        """
+        按批产出 (图片数组 (B, H, W, 3), 类别 id 数组)，每批只读取同一个分片；
+        不打乱时图片数组是分片的视图，打乱时先打乱分片顺序、再在分片内打乱（按行号排序读取后复制成一批）
+        """
+        rng = np.random.default_rng(seed)
+        shard_ids = rng.permutation(len(self.shards)) if shuffle else range(len(self.shards))
+        for shard_id in shard_ids:
+            shard = self.shards[shard_id]
+            start = shard_id * self.shard_size
+            order = rng.permutation(len(shard)) if shuffle else None
+            for batch_start in range(0, len(shard), batch_size):
+                if order is None:
+                    imgs = shard[batch_start:batch_start + batch_size]  # 连续切片，不复制
+                    yield imgs, self.labels[start + batch_start:start + batch_start + len(imgs)]
+                else:
+                    rows = np.sort(order[batch_start:batch_start + batch_size])
+                    yield shard[rows], self.labels[start + rows]
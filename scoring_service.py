@@ -0,0 +1,193 @@
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from annotation_index import CLASS_NAMES
+from end_for_testdatasets import boxes_to_array, classify_detections, load_model
+from instrumentation import metrics
+from threshold_metrics import normal_ratio
+
+
+class MicroBatcher:
+    """
+    将并发请求的图片合并成小批次推理：收到第一张图片后最多等待 max_wait 秒或凑满 max_batch 张即开始推理
+    模型只在后台线程中调用，同一批次内按图片尺寸分组，保证与逐张推理的 letterbox 方式一致
+    """
+
+    def __init__(self, model, max_batch=8, max_wait=0.01):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, img):
+        """提交一张图片，阻塞直到得到它的 (N, 6) 检测框数组"""
+        future = Future()
+        self.queue.put((img, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        groups = defaultdict(list)
+        for img, future in batch:
+            groups[img.shape].append((img, future))
+        for items in groups.values():
+            imgs = [img for img, _ in items]
+            metrics.observe("batch_size", len(imgs), buckets=(1, 2, 4, 8, 16, 32, 64))
+            try:
+                with metrics.stage("inference"):
+                    results = self.model(imgs) if len(imgs) > 1 else self.model(imgs[0])
+                for (_, future), result in zip(items, results):
+                    future.set_result(boxes_to_array(result))
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+def score_response(pred, thresholds):
+    """按阈值判定 fit/unfit，并返回各类别检测框数量"""
+    class_ids = pred[:, 5].astype(int) if pred.size > 0 else np.array([], dtype=int)
+    counts = np.bincount(class_ids, minlength=len(CLASS_NAMES))[:len(CLASS_NAMES)]
+    ratio = normal_ratio(pred)
+    return {
+        "classification": {str(threshold): label for threshold, label in classify_detections(pred, thresholds).items()},
+        "counts": {name: int(count) for name, count in zip(CLASS_NAMES, counts)},
+        "normal_ratio": float(ratio) if np.isfinite(ratio) else None,
+    }
+
+
+def make_handler(batcher, default_thresholds):
+    """
+    构造请求处理类：POST /score 请求体为图片文件内容，可用 ?thresholds=0.57,0.7 覆盖默认阈值；
+    GET /metrics 返回 Prometheus 文本格式的指标
+    """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif path == "/metrics":
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/score":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                query = parse_qs(url.query)
+                thresholds = ([float(t) for t in query["thresholds"][0].split(",")]
+                              if "thresholds" in query else default_thresholds)
+            except ValueError:
+                self._send_json(400, {"error": "invalid thresholds"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                length = -1
+            if length <= 0:
+                metrics.count("requests_failed")
+                self.close_connection = True  # 请求体长度未知，不再复用该连接
+                self._send_json(400, {"error": "empty body or invalid Content-Length"})
+                return
+            try:
+                with metrics.stage("decode"):
+                    img = cv2.imdecode(np.frombuffer(self.rfile.read(length), dtype=np.uint8), cv2.IMREAD_COLOR)
+            except cv2.error:
+                img = None
+            if img is None:
+                metrics.count("requests_failed")
+                self._send_json(400, {"error": "unable to decode image"})
+                return
+
+            start = time.perf_counter()
+            try:
+                pred = batcher.submit(img)
+            except Exception as e:
+                metrics.count("requests_failed")
+                self._send_json(500, {"error": str(e)})
+                return
+            response = score_response(pred, thresholds)
+            latency = time.perf_counter() - start
+            metrics.count("requests")
+            metrics.observe("request_seconds", latency)
+            response["latency_ms"] = round(latency * 1000, 2)
+            self._send_json(200, response)
+
+        def log_message(self, format, *args):
+            pass  # 不为每个请求打印访问日志
+
+    return ScoringHandler
+
+
+def serve(model_path, host="127.0.0.1", port=8000, thresholds=(0.57, 0.7, 0.8), max_batch=8, max_wait_ms=10,
+          model_options=None):
+    """加载模型并预热后启动评分服务，模型常驻内存，直到进程退出"""
+    model = load_model(model_path, **(model_options or {}))
+    batcher = MicroBatcher(model, max_batch=max_batch, max_wait=max_wait_ms / 1000)
+    batcher.submit(np.zeros((640, 640, 3), dtype=np.uint8))  # 预热，避免第一个请求承担初始化开销
+
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, list(thresholds)))
+    print(f"Scoring service listening on http://{host}:{port}/score")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻内存的指甲图片评分服务（微批量推理）。")
+    parser.add_argument("model", nargs='?', default='./runs/train/custom_experiment_8s_0902_0.001_20018/weights/best.pt',
+                        help="模型权重路径（.pt / .onnx / OpenVINO 模型目录）")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--thresholds", default="0.57,0.7,0.8", help="默认阈值，逗号分隔")
+    parser.add_argument("--max_batch", type=int, default=8, help="微批量的最大图片数")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="凑批的最长等待时间（毫秒）")
+    args = parser.parse_args()
+
+    serve(args.model, args.host, args.port, [float(t) for t in args.thresholds.split(",")],
+          max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
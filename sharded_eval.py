@@ -0,0 +1,211 @@
+import os
+import re
+import glob
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from end_for_testdatasets import LazyModel, evaluate_dataset, options_tag
+from file_utils import load_json, path_sha256, save_json
+from threading_env import pin_threads, pinned_thread_env
+from threshold_metrics import RunningCounts, format_roc_summary, write_roc_report
+
+SHARD_PATTERN = "shard_{:05d}_of_{:05d}"
+SHARD_REGEX = re.compile(r"shard_(\d+)_of_(\d+)\.counts\.json$")
+
+_worker_models = {}  # 工作进程内按 (模型路径, 参数) 缓存的模型，每个进程只加载一次
+
+
+def run_dir(output_dir, model_path, num_shards, model_options=None):
+    """
+    一次分片评估的结果目录 <output_dir>/<模型名>-<权重哈希>-<分片总数>shards：
+    更换模型或分片总数时写入新的目录，不会与旧结果混合；各机器对相同权重得到相同的目录
+    """
+    return os.path.join(output_dir, f"{_run_prefix(model_path, model_options)}-{num_shards}shards")
+
+
+def _run_prefix(model_path, model_options=None):
+    """<模型名>-<哈希>：哈希由权重内容与影响检测结果的 model_options 计算，默认参数时即为权重哈希"""
+    stem = os.path.splitext(os.path.basename(os.path.normpath(model_path)))[0]
+    digest = path_sha256(model_path)
+    tag = options_tag(model_options)
+    if tag:
+        digest = hashlib.sha256(f"{digest}:{tag}".encode('utf-8')).hexdigest()
+    return f"{stem}-{digest[:12]}"
+
+
+def _shard_prefix(output_dir, shard_id, num_shards):
+    return os.path.join(output_dir, SHARD_PATTERN.format(shard_id, num_shards))
+
+
+def _find_shards(directory):
+    """目录中已完成的分片 {(分片编号, 分片总数): 计数器文件路径}"""
+    found = {}
+    for path in glob.glob(os.path.join(directory, "shard_*_of_*.counts.json")):
+        match = SHARD_REGEX.search(os.path.basename(path))
+        if match:
+            found[(int(match.group(1)), int(match.group(2)))] = path
+    return found
+
+
+def _counts_from_csv(results_path, thresholds):
+    """由分片的逐张结果 CSV 重新计算计数器"""
+    per_image = pd.read_csv(results_path, usecols=['True Label', 'Normal Ratio'])
+    counts = RunningCounts(thresholds)
+    counts.update_many(per_image['Normal Ratio'].to_numpy(dtype=np.float64),
+                       (per_image['True Label'] == 'r_unfit').to_numpy())
+    return counts
+
+
+def evaluate_shard(model_path, image_dir, thresholds, shard_id, num_shards, output_dir, batch_size=8,
+                   decode_threads=1, cache_dir=None, model_options=None, chunk_size=1000, resume=True):
+    """
+    评估一个分片：图片按文件名稳定哈希分配到 num_shards 个分片中，与机器和进程数无关
+    逐张结果流式写入 run_dir(output_dir, ...) 下的 shard_XXXXX_of_YYYYY.csv（可续跑），完成后写入同名
+    .counts.json 计数器，计数器文件存在即表示该分片已完成；返回 RunningCounts
+    """
+    output_dir = run_dir(output_dir, model_path, num_shards, model_options)
+    os.makedirs(output_dir, exist_ok=True)
+    key = (model_path, tuple(sorted((model_options or {}).items())))
+    if key not in _worker_models:
+        _worker_models[key] = LazyModel(model_path, **(model_options or {}))
+
+    prefix = _shard_prefix(output_dir, shard_id, num_shards)
+    evaluate_dataset(model_path, image_dir, thresholds, batch_size=batch_size, num_workers=decode_threads,
+                     cache_dir=cache_dir, results_path=prefix + ".csv", chunk_size=chunk_size, resume=resume,
+                     model=_worker_models[key], shard=(shard_id, num_shards))
+    counts = _counts_from_csv(prefix + ".csv", thresholds)
+    save_json(prefix + ".counts.json", counts.to_dict())
+    return counts
+
+
+def _select_run(output_dir, model_path=None, num_shards=None, model_options=None):
+    """
+    在 output_dir 的各次运行目录中选出要合并的一次：按模型与分片总数筛选，优先选择全部分片已完成的、
+    最近更新的目录；返回 (目录, 分片总数, 已完成的分片)
+    """
+    pattern = glob.escape(_run_prefix(model_path, model_options)) + "-*shards" if model_path else "*shards"
+    candidates = []
+    for directory in glob.glob(os.path.join(output_dir, pattern)):
+        found = _find_shards(directory)
+        for total in {total for _, total in found}:
+            if num_shards is None or total == num_shards:
+                finished = {key: path for key, path in found.items() if key[1] == total}
+                latest = max(os.path.getmtime(path) for path in finished.values())
+                candidates.append((len(finished) == total, latest, directory, total, finished))
+    if not candidates:
+        raise FileNotFoundError(f"No finished shards found in {output_dir}")
+    complete, _, directory, total, finished = max(candidates, key=lambda c: (c[0], c[1]))
+    if not complete:
+        missing = [shard_id for shard_id in range(total) if (shard_id, total) not in finished]
+        raise ValueError(f"{len(missing)} of {total} shards in {directory} are not finished yet: {missing[:10]}")
+    if len(candidates) > 1:
+        print(f"合并 {directory}（共 {len(candidates)} 次运行，可用 model_path / num_shards 指定）")
+    return directory, total, finished
+
+
+def merge_shards(output_dir, thresholds=None, roc_dir=None, model_path=None, num_shards=None, model_options=None):
+    """
+    合并一次分片评估的全部计数器，返回与 evaluate_dataset 相同格式的 TPR / TNR 表
+    output_dir 为 evaluate_shard 使用的结果目录，其中每个模型与分片总数各有一个运行目录；
+    model_path / num_shards / model_options 用于选择运行，未指定时合并最近完成的一次。分片不完整时抛出 ValueError
+    thresholds 与分片记录的阈值不同时由各分片的逐张结果重新计算
+    roc_dir: 若指定，则用全部分片的逐张结果写入 ROC 曲线与 AUC
+    """
+    output_dir, num_shards, found = _select_run(output_dir, model_path, num_shards, model_options)
+
+    total = None
+    for shard_id in range(num_shards):
+        counts = RunningCounts.from_dict(load_json(found[(shard_id, num_shards)]))
+        if thresholds is not None and counts.thresholds != list(thresholds):
+            counts = _counts_from_csv(_shard_prefix(output_dir, shard_id, num_shards) + ".csv", thresholds)
+        if total is None:
+            total = counts
+        else:
+            total.merge(counts)
+
+    if roc_dir is not None:
+        per_image = pd.concat([pd.read_csv(_shard_prefix(output_dir, shard_id, num_shards) + ".csv",
+                                           usecols=['True Label', 'Normal Ratio']) for shard_id in range(num_shards)])
+        summary = write_roc_report(per_image['Normal Ratio'].to_numpy(dtype=np.float64),
+                                   (per_image['True Label'] == 'r_unfit').to_numpy(), roc_dir)
+        print(format_roc_summary(summary))
+    return total.table()
+
+
+def evaluate_sharded(model_path, image_dir, thresholds, output_dir, num_workers=None, threads_per_worker=1,
+                     num_shards=None, batch_size=8, decode_threads=1, cache_dir=None, model_options=None,
+                     roc_dir=None, chunk_size=1000, resume=True):
+    """
+    在本机用 num_workers 个进程并行评估：每个进程加载一个模型，计算线程数固定为 threads_per_worker，
+    依次领取分片（默认 num_shards = num_workers），全部完成后合并计数器
+    num_workers 默认 CPU 核数 // threads_per_worker；.onnx 模型默认 intra_op_threads = threads_per_worker
+    多台机器时各自用 evaluate_shard 处理不同分片并写入同一共享目录，再运行 merge_shards
+    """
+    num_workers = num_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    num_shards = num_shards or num_workers
+    model_options = dict(model_options or {})
+    if model_path.endswith(".onnx"):
+        model_options.setdefault("intra_op_threads", threads_per_worker)
+
+    with pinned_thread_env(threads_per_worker), \
+            ProcessPoolExecutor(max_workers=num_workers, mp_context=get_context("spawn"),
+                                initializer=pin_threads, initargs=(threads_per_worker,)) as executor:
+        futures = {executor.submit(evaluate_shard, model_path, image_dir, thresholds, shard_id, num_shards,
+                                   output_dir, batch_size, decode_threads, cache_dir, model_options,
+                                   chunk_size, resume): shard_id for shard_id in range(num_shards)}
+        for finished, future in enumerate(as_completed(futures), 1):
+            future.result()
+            print(f"分片 {futures[future]} 完成（{finished}/{num_shards}）")
+    return merge_shards(output_dir, thresholds, roc_dir, model_path=model_path, num_shards=num_shards,
+                        model_options=model_options)
+
+
+def print_results(results):
+    df_results = pd.DataFrame.from_dict(results, orient='index')
+    df_results.index.name = "Threshold"
+    df_results.columns = ['真阳率(TPR)', '真阴率(TNR)']
+    print(df_results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程 / 多机分片评估：local 本机并行；run 处理指定分片；merge 合并共享目录中的分片结果。")
+    parser.add_argument("command", choices=["local", "run", "merge"])
+    parser.add_argument("--model", default='./runs/train/custom_experiment_8s_0902_0.001_20018/weights/best.pt',
+                        help="模型权重路径")
+    parser.add_argument("--image_dir", default='./TestDatasets', help="测试图片目录")
+    parser.add_argument("--output_dir", default='./eval_shards', help="分片结果目录（多机时为共享目录）")
+    parser.add_argument("--thresholds", default="0.57,0.7,0.8", help="阈值，逗号分隔")
+    parser.add_argument("--workers", type=int, default=None, help="local：工作进程数，默认 CPU 核数 // threads")
+    parser.add_argument("--threads", type=int, default=1, help="每个工作进程的计算线程数")
+    parser.add_argument("--num_shards", type=int, default=None, help="分片总数（run 时必填）")
+    parser.add_argument("--shard", type=int, nargs='+', default=None, help="run：本机处理的分片编号")
+    parser.add_argument("--batch_size", type=int, default=8, help="批量推理的图片数量")
+    parser.add_argument("--cache_dir", default=None, help="检测结果缓存目录")
+    parser.add_argument("--roc_dir", default=None, help="合并时写入 ROC 曲线的目录")
+    args = parser.parse_args()
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+
+    if args.command == "local":
+        print_results(evaluate_sharded(args.model, args.image_dir, thresholds, args.output_dir,
+                                       num_workers=args.workers, threads_per_worker=args.threads,
+                                       num_shards=args.num_shards, batch_size=args.batch_size,
+                                       cache_dir=args.cache_dir, roc_dir=args.roc_dir))
+    elif args.command == "run":
+        if args.num_shards is None or args.shard is None:
+            parser.error("run 需要 --num_shards 与 --shard")
+        pin_threads(args.threads)
+        model_options = {"intra_op_threads": args.threads} if args.model.endswith(".onnx") else None
+        for shard_id in args.shard:
+            evaluate_shard(args.model, args.image_dir, thresholds, shard_id, args.num_shards, args.output_dir,
+                           batch_size=args.batch_size, cache_dir=args.cache_dir, model_options=model_options)
+            print(f"分片 {shard_id} 完成")
+    else:
+        # 合并的机器上没有权重文件时不按模型筛选
+        model_path = args.model if os.path.exists(args.model) else None
+        print_results(merge_shards(args.output_dir, thresholds, args.roc_dir, model_path=model_path,
+                                   num_shards=args.num_shards))
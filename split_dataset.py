@@ -1,59 +1,118 @@
-import os
-import random
-import shutil
-
-
-def clear_directory(directory):
-    if os.path.exists(directory):
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-
-
-def split_dataset(dataset_dir, label_dir, train_ratio=0.9):
-    images = [f for f in os.listdir(dataset_dir) if f.endswith(('.jpg', '.png')) and os.path.exists(
-        os.path.join(label_dir, f.replace('.jpg', '.txt').replace('.png', '.txt')))]
-    random.shuffle(images)
-
-    train_size = int(len(images) * train_ratio)
-    train_images = images[:train_size]
-    val_images = images[train_size:]
-
-    train_image_dir = 'yolov8/datasets/data/images/train'
-    val_image_dir = 'yolov8/datasets/data/images/val'
-    train_label_dir = 'yolov8/datasets/data/labels/train'
-    val_label_dir = 'yolov8/datasets/data/labels/val'
-
-    # 清空目标目录
-    clear_directory(train_image_dir)
-    clear_directory(val_image_dir)
-    clear_directory(train_label_dir)
-    clear_directory(val_label_dir)
-
-    if not os.path.exists(train_image_dir):
-        os.makedirs(train_image_dir)
-    if not os.path.exists(val_image_dir):
-        os.makedirs(val_image_dir)
-    if not os.path.exists(train_label_dir):
-        os.makedirs(train_label_dir)
-    if not os.path.exists(val_label_dir):
-        os.makedirs(val_label_dir)
-
-    for img in train_images:
-        shutil.copy(os.path.join(dataset_dir, img), os.path.join(train_image_dir, img))
-        shutil.copy(os.path.join(label_dir, img.replace('.jpg', '.txt').replace('.png', '.txt')),
-                    os.path.join(train_label_dir, img.replace('.jpg', '.txt').replace('.png', '.txt')))
-
-    for img in val_images:
-        shutil.copy(os.path.join(dataset_dir, img), os.path.join(val_image_dir, img))
-        shutil.copy(os.path.join(label_dir, img.replace('.jpg', '.txt').replace('.png', '.txt')),
-                    os.path.join(val_label_dir, img.replace('.jpg', '.txt').replace('.png', '.txt')))
-
-
-if __name__ == "__main__":
-    dataset_dir = 'mydatasets'
-    label_dir = 'yolov8/datasets/data/labels'
-    split_dataset(dataset_dir, label_dir)
+import os
+import shutil
+from collections import Counter
+
+from annotation_index import AnnotationIndex, INDEX_NAME
+from file_utils import load_json, save_json, sync_directory
+from hash_split import hash_split
+
+SPLIT_MODES = ("copy", "hardlink", "symlink", "list")
+
+
+def clear_directory(directory):
+    if os.path.exists(directory):
+        for filename in os.listdir(directory):
+            file_path = os.path.join(directory, filename)
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+
+
+def label_name(img):
+    return img.replace('.jpg', '.txt').replace('.png', '.txt')
+
+
+def dominant_class(label_path):
+    """标签文件中数量最多的类别 id（数量相同时取较小的 id），空标签返回 empty"""
+    counts = Counter()
+    with open(label_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if parts:
+                counts[parts[0]] += 1
+    if not counts:
+        return "empty"
+    return min(counts, key=lambda class_id: (-counts[class_id], class_id))
+
+
+def _strata(images, label_dir, index=None):
+    """每张图片的分层类别；索引中没有的图片（如直接提供的 TXT 标签）读取标签文件"""
+    indexed = {}
+    if index is not None:
+        indexed = {name: str(c) if c >= 0 else "empty" for name, c in zip(index.names, index.dominant_classes())}
+    return {img: indexed.get(os.path.splitext(img)[0]) or dominant_class(os.path.join(label_dir, label_name(img)))
+            for img in images}
+
+
+def write_file_list(list_path, paths):
+    """写入 Ultralytics 格式的图片列表文件（每行一个绝对路径）"""
+    tmp_path = list_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            f.write(os.path.abspath(path) + "\n")
+    os.replace(tmp_path, list_path)
+
+
+def split_dataset(dataset_dir, label_dir, train_ratio=0.9, mode="copy", output_dir='yolov8/datasets/data',
+                  stratify=False, assignment_path=None, index=None):
+    """
+    按文件名的稳定哈希划分训练集与验证集，并放置到 output_dir/images/{train,val} 与 output_dir/labels/{train,val}
+    stratify: 按标签中数量最多的类别分层，使每个类别的 train/val 比例都接近 train_ratio
+    assignment_path: 划分结果记录文件，默认 output_dir/split_assignments.json；
+                     已记录的图片保持原划分，新增图片只分配自身，train_ratio 或 stratify 变化时重新划分
+    mode: "copy" 复制；"hardlink" / "symlink" 使用硬链接或软链接（失败时退回复制）；
+          "list" 只把全部图片和标签链接一次到 images/all、labels/all，划分结果写为 train.txt / val.txt 列表
+    重新划分时只处理变化的部分：已存在且未变化的文件不会重写，不再属于该集合的文件被删除
+    index: 标注索引（annotation_index.AnnotationIndex），分层时直接使用索引中的类别，不再读取标签文件
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"Unknown split mode: {mode}, expected one of {SPLIT_MODES}")
+
+    images = sorted(f for f in os.listdir(dataset_dir) if f.endswith(('.jpg', '.png')) and os.path.exists(
+        os.path.join(label_dir, label_name(f))))
+
+    assignment_path = assignment_path or os.path.join(output_dir, 'split_assignments.json')
+    record = load_json(assignment_path, {})
+    previous = None
+    if record.get("train_ratio") == train_ratio and record.get("stratify") == stratify:
+        previous = record.get("assignments")
+    strata = _strata(images, label_dir, index) if stratify else None
+    assignment = hash_split(images, train_ratio, strata=strata, previous=previous)
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_json(assignment_path, {"train_ratio": train_ratio, "stratify": stratify, "assignments": assignment})
+    train_images = [img for img in images if assignment[img] == "train"]
+    val_images = [img for img in images if assignment[img] == "val"]
+
+    if mode == "list":
+        # 图片与标签只需放置一次，重新划分时只重写两个列表文件
+        all_image_dir = os.path.join(output_dir, 'images', 'all')
+        all_label_dir = os.path.join(output_dir, 'labels', 'all')
+        sync_directory(all_image_dir, {img: os.path.join(dataset_dir, img) for img in images}, "hardlink")
+        sync_directory(all_label_dir, {label_name(img): os.path.join(label_dir, label_name(img)) for img in images},
+                       "hardlink")
+        for split, split_images in [("train", train_images), ("val", val_images)]:
+            write_file_list(os.path.join(output_dir, f'{split}.txt'),
+                            [os.path.join(all_image_dir, img) for img in split_images])
+        print(f"Wrote {len(train_images)} train / {len(val_images)} val image lists to {output_dir}")
+        return train_images, val_images
+
+    for split, split_images in [("train", train_images), ("val", val_images)]:
+        image_stats = sync_directory(os.path.join(output_dir, 'images', split),
+                                     {img: os.path.join(dataset_dir, img) for img in split_images}, mode)
+        label_stats = sync_directory(os.path.join(output_dir, 'labels', split),
+                                     {label_name(img): os.path.join(label_dir, label_name(img))
+                                      for img in split_images}, mode)
+        added, removed, unchanged = (a + b for a, b in zip(image_stats, label_stats))
+        print(f"{split}: {added} files placed, {removed} removed, {unchanged} unchanged")
+
+    return train_images, val_images
+
+
+if __name__ == "__main__":
+    dataset_dir = 'mydatasets'
+    label_dir = 'yolov8/datasets/data/labels'
+    # 若已建立标注索引（convert_to_yolo_format.py / classification_dataset.py），分层划分时直接使用
+    index = AnnotationIndex.load(os.path.join(dataset_dir, INDEX_NAME))
+    split_dataset(dataset_dir, label_dir, mode="hardlink", index=index)
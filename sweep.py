@@ -0,0 +1,204 @@
+import os
+import glob
+import math
+import random
+import shutil
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from file_utils import load_json, save_json
+from threading_env import pin_threads, pinned_thread_env
+
+# 搜索空间：列表为候选值；(下限, 上限) 元组在随机搜索中按对数均匀分布采样，网格搜索时取两端
+SEARCH_SPACE = {
+    "learning_rate": (1e-4, 1e-2),
+    "batch_size": [8, 16, 32],
+    "model_config": ['./yolov8n.pt', './yolov8s.pt'],
+    "imgsz": [640, 800],
+}
+PRUNE_METRIC = "metrics/mAP50-95(B)"
+STATE_NAME = "sweep_state.json"
+LEADERBOARD_NAME = "leaderboard.csv"
+
+
+def _candidates(values):
+    return list(values) if isinstance(values, list) else [values[0], values[1]]
+
+
+def grid_configs(space):
+    """网格搜索：全部候选值的组合"""
+    keys = list(space)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*(_candidates(space[key]) for key in keys))]
+
+
+def random_configs(space, num_trials, seed=0):
+    """随机搜索：列表均匀选择，(下限, 上限) 对数均匀采样；相同 seed 得到相同配置"""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_trials):
+        config = {}
+        for key, values in space.items():
+            if isinstance(values, list):
+                config[key] = rng.choice(values)
+            else:
+                low, high = values
+                config[key] = float(f"{math.exp(rng.uniform(math.log(low), math.log(high))):.3g}")
+        configs.append(config)
+    return configs
+
+
+def run_name(config):
+    """由配置生成确定的实验名称，如 sweep_lr0.001_b16_yolov8n_640"""
+    model = os.path.splitext(os.path.basename(config["model_config"]))[0]
+    return f"sweep_lr{config['learning_rate']:g}_b{config['batch_size']}_{model}_{config['imgsz']}"
+
+
+def read_results(results_csv):
+    """读取 Ultralytics 的逐轮 results.csv（列名去除首尾空格），文件不存在时返回空表"""
+    if not os.path.exists(results_csv):
+        return pd.DataFrame()
+    results = pd.read_csv(results_csv)
+    results.columns = [column.strip() for column in results.columns]
+    return results
+
+
+class MedianPruner:
+    """
+    中位数剪枝：训练满 min_epochs 轮后，若本次运行到当前轮为止的最好指标低于其他运行在同一轮时最好指标的中位数，
+    则提前结束；至少需要 min_runs 个其他运行达到该轮才会剪枝。指标越大越好
+    """
+
+    def __init__(self, metric=PRUNE_METRIC, min_epochs=5, min_runs=2):
+        self.metric = metric
+        self.min_epochs = min_epochs
+        self.min_runs = min_runs
+
+    def best_until(self, results, epoch):
+        if self.metric not in results or len(results) < epoch:
+            return None
+        return float(results[self.metric].iloc[:epoch].max())
+
+    def should_prune(self, results, other_results):
+        epoch = len(results)
+        if epoch < self.min_epochs:
+            return False
+        current = self.best_until(results, epoch)
+        others = [value for value in (self.best_until(other, epoch) for other in other_results) if value is not None]
+        return current is not None and len(others) >= self.min_runs and current < float(np.median(others))
+
+
+def _train_job(data_config, config, name, project, epochs, pruner, cache, workers):
+    """子进程任务：训练一个配置，每轮结束时按其他运行的 results.csv 判断是否剪枝，返回 (状态, 结果目录)"""
+    from train import train
+
+    pruned = []
+
+    def on_fit_epoch_end(trainer):
+        results = read_results(os.path.join(trainer.save_dir, "results.csv"))
+        other_results = [read_results(path) for path in glob.glob(os.path.join(project, "*", "results.csv"))
+                         if os.path.dirname(os.path.abspath(path)) != os.path.abspath(trainer.save_dir)]
+        if pruner.should_prune(results, other_results):
+            print(f"{name}: 第 {len(results)} 轮指标低于其他运行的中位数，提前结束")
+            pruned.append(len(results))
+            trainer.stop = True
+
+    save_dir = train(data_config, config["model_config"], epochs=epochs, batch_size=config["batch_size"],
+                     learning_rate=config["learning_rate"], imgsz=config["imgsz"], name=name, project=project,
+                     cache=cache, callbacks={"on_fit_epoch_end": on_fit_epoch_end}, exist_ok=True, workers=workers)
+    return ("pruned" if pruned else "done"), save_dir
+
+
+def write_leaderboard(project, metric=PRUNE_METRIC):
+    """汇总全部运行的最好指标、所在轮次与状态，按指标从高到低写入 <project>/leaderboard.csv 并返回"""
+    state = load_json(os.path.join(project, STATE_NAME), {})
+    rows = []
+    for name, job in state.items():
+        results = read_results(os.path.join(job.get("save_dir") or os.path.join(project, name), "results.csv"))
+        has_metric = metric in results and len(results) > 0
+        rows.append({
+            "name": name, **job["config"], "status": job["status"], "epochs": len(results),
+            metric: float(results[metric].max()) if has_metric else np.nan,
+            "best_epoch": int(results[metric].idxmax()) + 1 if has_metric else np.nan,
+            "weights": os.path.join(job.get("save_dir") or "", "weights", "best.pt") if job.get("save_dir") else "",
+        })
+    leaderboard = pd.DataFrame(rows)
+    if not leaderboard.empty:
+        leaderboard = leaderboard.sort_values(metric, ascending=False, na_position="last")
+    leaderboard.to_csv(os.path.join(project, LEADERBOARD_NAME), index=False, encoding="utf-8-sig")
+    return leaderboard
+
+
+def run_sweep(data_config, configs, project='runs/sweep', epochs=50, parallel=1, pruner=None, cache="disk",
+              workers=2):
+    """
+    以作业队列运行一组配置：最多 parallel 个训练同时进行，每个训练的计算线程数为 CPU 核数 // parallel
+    cache: 数据缓存方式，默认 "disk"：图片只在第一次训练时解码并保存为 .npy，之后所有运行直接复用
+    作业状态记录在 <project>/sweep_state.json，中断后重新运行会跳过已完成或已剪枝的配置，
+    未完成或失败的配置删除其运行目录后重新训练
+    pruner: 剪枝规则，默认 MedianPruner()，为 False 时不剪枝；结束后写入排行榜并返回
+    """
+    os.makedirs(project, exist_ok=True)
+    pruner = MedianPruner() if pruner is None else pruner
+    if pruner is False:
+        pruner = MedianPruner(min_epochs=epochs + 1)  # 永远达不到开始剪枝的轮数
+    state_path = os.path.join(project, STATE_NAME)
+    state = load_json(state_path, {})
+
+    jobs = []
+    for config in configs:
+        name = run_name(config)
+        if state.get(name, {}).get("status") in ("done", "pruned") or name in dict(jobs):
+            continue  # 已完成，或随机搜索抽到了重复的配置
+        stale_dir = os.path.join(project, name)
+        if os.path.isdir(stale_dir):
+            # 中断或失败的运行从头开始：Ultralytics 会在已有的 results.csv 后追加，旧记录会打乱轮次与排行榜
+            shutil.rmtree(stale_dir)
+        state[name] = {"config": config, "status": "pending", "save_dir": None}
+        jobs.append((name, config))
+    save_json(state_path, state)
+    print(f"共 {len(configs)} 个配置，待运行 {len(jobs)} 个")
+
+    threads = max(1, (os.cpu_count() or 1) // parallel)
+    with pinned_thread_env(threads), \
+            ProcessPoolExecutor(max_workers=parallel, mp_context=get_context("spawn"),
+                                initializer=pin_threads, initargs=(threads,)) as executor:
+        futures = {executor.submit(_train_job, data_config, config, name, project, epochs, pruner, cache,
+                                   workers): name for name, config in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                state[name]["status"], state[name]["save_dir"] = future.result()
+            except Exception as e:
+                print(f"{name} 训练失败: {e}")
+                state[name]["status"] = "failed"
+            save_json(state_path, state)
+
+    leaderboard = write_leaderboard(project, pruner.metric)
+    print(leaderboard.to_string(index=False))
+    return leaderboard
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="超参数搜索：网格或随机搜索 train.train 的配置，支持中位数剪枝并输出排行榜。")
+    parser.add_argument("--data", default='./data/dataset.yaml', help="数据集配置文件")
+    parser.add_argument("--mode", choices=["grid", "random"], default="random", help="搜索方式")
+    parser.add_argument("--trials", type=int, default=12, help="随机搜索的配置数")
+    parser.add_argument("--seed", type=int, default=0, help="随机搜索的种子")
+    parser.add_argument("--epochs", type=int, default=50, help="每个配置的最大训练轮数")
+    parser.add_argument("--parallel", type=int, default=1, help="同时运行的训练数")
+    parser.add_argument("--project", default='runs/sweep', help="结果目录")
+    parser.add_argument("--min_epochs", type=int, default=5, help="开始剪枝前至少训练的轮数")
+    parser.add_argument("--no_prune", action="store_true", help="不剪枝，全部配置训练到结束")
+    parser.add_argument("--cache", default="disk", help="数据缓存方式：disk / ram / none")
+    args = parser.parse_args()
+
+    configs = grid_configs(SEARCH_SPACE) if args.mode == "grid" else random_configs(SEARCH_SPACE, args.trials,
+                                                                                     args.seed)
+    pruner = False if args.no_prune else MedianPruner(min_epochs=args.min_epochs)
+    run_sweep(args.data, configs, project=args.project, epochs=args.epochs, parallel=args.parallel, pruner=pruner,
+              cache=False if args.cache == "none" else args.cache)
@@ -0,0 +1,30 @@
+import os
+from contextlib import contextmanager
+
+import cv2
+
+# 多进程评估（sharded_eval.py）与超参数搜索（sweep.py）共用的线程数设置，不依赖评估或训练代码
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def pin_threads(num_threads):
+    """限制当前进程的计算线程数（OpenMP / MKL / OpenBLAS / OpenCV），torch 在导入时读取 OMP_NUM_THREADS"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(num_threads)
+    cv2.setNumThreads(num_threads)
+
+
+@contextmanager
+def pinned_thread_env(num_threads):
+    """临时设置线程数环境变量：在此期间以 spawn 方式启动的子进程继承该设置，保证 numpy / torch 导入前线程数已固定"""
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(num_threads)
+    try:
+        yield
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+def normal_ratio(pred):
+    """单张图片中 normal 类别检测框的占比；没有检测框时返回 -inf（任何阈值下都判为 unfit）"""
+    if pred.size == 0:
+        return -np.inf
+    pred_class_ids = pred[:, 5].astype(int)
+    return (pred_class_ids == 2).sum() / len(pred_class_ids)
+
+
+def sweep_thresholds(ratios, is_unfit, thresholds):
+    """
+    向量化计算任意阈值网格上的 TPR / TNR
+    ratios: 每张图片的 normal 占比，读取失败的图片为 nan（计入分母，但不会被判对）
+    is_unfit: 每张图片的真实标签是否为 unfit
+    判定规则与 classify_detections 一致：ratio >= threshold 为 fit，否则为 unfit
+    """
+    ratios = np.asarray(ratios, dtype=np.float64)
+    is_unfit = np.asarray(is_unfit, dtype=bool)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    valid = ~np.isnan(ratios)
+    fit_sorted = np.sort(ratios[valid & ~is_unfit])
+    unfit_sorted = np.sort(ratios[valid & is_unfit])
+    r_fit_count = np.count_nonzero(~is_unfit)
+    r_unfit_count = np.count_nonzero(is_unfit)
+
+    # 真阴：真实 fit 且 ratio >= threshold；真阳：真实 unfit 且 ratio < threshold
+    true_negative = len(fit_sorted) - np.searchsorted(fit_sorted, thresholds, side='left')
+    true_positive = np.searchsorted(unfit_sorted, thresholds, side='left')
+
+    tnr = true_negative / r_fit_count if r_fit_count > 0 else np.zeros(len(thresholds))
+    tpr = true_positive / r_unfit_count if r_unfit_count > 0 else np.zeros(len(thresholds))
+    return tpr, tnr
+
+
+def threshold_table(ratios, is_unfit, thresholds):
+    """按 evaluate_dataset 的返回格式整理结果：{threshold: {"TPR": ..., "TNR": ...}}"""
+    tpr, tnr = sweep_thresholds(ratios, is_unfit, thresholds)
+    return {threshold: {"TPR": float(tpr[i]), "TNR": float(tnr[i])} for i, threshold in enumerate(thresholds)}
+
+
+def roc_curve(ratios, is_unfit):
+    """
+    以 unfit 为阳性计算完整 ROC 曲线
+    候选阈值取所有不同的有限 ratio 值，并在末端补上 inf（全部判为 unfit）；
+    没有检测框的图片 (ratio = -inf) 在任何阈值下都判为 unfit，因此不使用 -inf 作为阈值
+    返回 (thresholds, fpr, tpr)，fpr 单调不减
+    """
+    ratios = np.asarray(ratios, dtype=np.float64)
+    finite = np.unique(ratios[np.isfinite(ratios)])
+    thresholds = np.concatenate((finite, [np.inf]))
+    tpr, tnr = sweep_thresholds(ratios, is_unfit, thresholds)
+    return thresholds, 1 - tnr, tpr
+
+
+def roc_summary(ratios, is_unfit):
+    """
+    计算 ROC 曲线、AUC 以及约登指数 (TPR + TNR - 1) 最大的阈值
+    AUC 按从 (0, 0) 出发的曲线计算；约登最优阈值为 inf（全部判为 unfit）时记为 None
+    """
+    thresholds, fpr, tpr = roc_curve(ratios, is_unfit)
+    curve_fpr, curve_tpr = np.concatenate(([0.0], fpr)), np.concatenate(([0.0], tpr))
+    auc = float(np.sum(np.diff(curve_fpr) * (curve_tpr[1:] + curve_tpr[:-1]) / 2))
+    youden = tpr - fpr
+    best = int(np.argmax(youden))
+    summary = {
+        "AUC": auc,
+        "Youden threshold": float(thresholds[best]) if np.isfinite(thresholds[best]) else None,
+        "Youden J": float(youden[best]),
+        "TPR": float(tpr[best]),
+        "TNR": float(1 - fpr[best]),
+    }
+    curve = pd.DataFrame({"Threshold": thresholds, "FPR": fpr, "TPR": tpr})
+    return curve, summary
+
+
+def format_roc_summary(summary):
+    """ROC 摘要的一行文字说明"""
+    threshold = summary['Youden threshold']
+    threshold_text = f"{threshold:.4f}" if threshold is not None else "无（全部判为 unfit）"
+    return f"AUC: {summary['AUC']:.4f}，约登最优阈值: {threshold_text}"
+
+
+def write_roc_report(ratios, is_unfit, output_dir):
+    """将 ROC 曲线写入 roc.csv，AUC 与约登最优阈值写入 roc_summary.json"""
+    os.makedirs(output_dir, exist_ok=True)
+    curve, summary = roc_summary(ratios, is_unfit)
+    curve.to_csv(os.path.join(output_dir, "roc.csv"), index=False, encoding="utf-8-sig")
+    with open(os.path.join(output_dir, "roc_summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+class RunningCounts:
+    """流式评估的计数器：逐张累加各阈值下的真阳 / 真阴数量，内存占用与图片数量无关"""
+
+    def __init__(self, thresholds):
+        self.thresholds = list(thresholds)
+        self._threshold_array = np.asarray(self.thresholds, dtype=np.float64)
+        self.r_fit_count = 0
+        self.r_unfit_count = 0
+        self.true_negative = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.true_positive = np.zeros(len(self.thresholds), dtype=np.int64)
+
+    def update(self, ratio, is_unfit):
+        """累加一张图片；ratio 为 nan（读取失败）时只计入分母"""
+        if is_unfit:
+            self.r_unfit_count += 1
+            if not np.isnan(ratio):
+                self.true_positive += ratio < self._threshold_array
+        else:
+            self.r_fit_count += 1
+            if not np.isnan(ratio):
+                self.true_negative += ratio >= self._threshold_array
+
+    def update_many(self, ratios, is_unfit):
+        """向量化累加一批图片，结果与逐张 update 相同"""
+        ratios = np.asarray(ratios, dtype=np.float64)
+        is_unfit = np.asarray(is_unfit, dtype=bool)
+        valid = ~np.isnan(ratios)
+        self.r_unfit_count += int(np.count_nonzero(is_unfit))
+        self.r_fit_count += int(np.count_nonzero(~is_unfit))
+        unfit_sorted = np.sort(ratios[valid & is_unfit])
+        fit_sorted = np.sort(ratios[valid & ~is_unfit])
+        self.true_positive += np.searchsorted(unfit_sorted, self._threshold_array, side='left')
+        self.true_negative += len(fit_sorted) - np.searchsorted(fit_sorted, self._threshold_array, side='left')
+
+    def merge(self, other):
+        """合并另一个相同阈值的计数器（如其他分片的结果）"""
+        if other.thresholds != self.thresholds:
+            raise ValueError(f"Cannot merge counts with different thresholds: {other.thresholds} != {self.thresholds}")
+        self.r_fit_count += other.r_fit_count
+        self.r_unfit_count += other.r_unfit_count
+        self.true_negative += other.true_negative
+        self.true_positive += other.true_positive
+
+    def to_dict(self):
+        return {"thresholds": self.thresholds, "r_fit_count": self.r_fit_count, "r_unfit_count": self.r_unfit_count,
+                "true_negative": self.true_negative.tolist(), "true_positive": self.true_positive.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        counts = cls(data["thresholds"])
+        counts.r_fit_count = data["r_fit_count"]
+        counts.r_unfit_count = data["r_unfit_count"]
+        counts.true_negative[:] = data["true_negative"]
+        counts.true_positive[:] = data["true_positive"]
+        return counts
+
+    def table(self):
+        """按 evaluate_dataset 的返回格式整理结果"""
+        results = {}
+        for i, threshold in enumerate(self.thresholds):
+            tnr = self.true_negative[i] / self.r_fit_count if self.r_fit_count > 0 else 0
+            tpr = self.true_positive[i] / self.r_unfit_count if self.r_unfit_count > 0 else 0
+            results[threshold] = {"TPR": float(tpr), "TNR": float(tnr)}
+        return results
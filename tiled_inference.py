@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+
+from box_ops import nms
+from end_for_testdatasets import boxes_to_array, prefetch_images
+from instrumentation import get_logger, metrics
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+logger = get_logger(__name__)
+
+
+def load_image(img_path, max_side=None):
+    """
+    解码图片，返回 (图片, 缩小倍数)；读取失败时图片为 None
+    指定 max_side 时，根据文件头中的尺寸选择 libjpeg 的 1/2、1/4、1/8 缩小解码，保证长边不小于 max_side，
+    避免先完整解码 12MP 原图再缩小
+    """
+    if max_side:
+        try:
+            with Image.open(img_path) as img:
+                long_side = max(img.size)
+        except (IOError, SyntaxError):
+            return None, 1
+        for factor, flag in REDUCED_FLAGS:
+            if long_side / factor >= max_side:
+                return cv2.imread(img_path, flag), factor
+    return cv2.imread(img_path), 1
+
+
+def tile_starts(length, tile_size, overlap):
+    """一维上的分块起点，最后一块贴齐边缘，保证所有分块尺寸相同"""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def make_tiles(height, width, tile_size=640, overlap=0.2):
+    """将图片划分为相互重叠的分块，返回 [(x0, y0, x1, y1)]"""
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in tile_starts(height, tile_size, overlap)
+            for x0 in tile_starts(width, tile_size, overlap)]
+
+
+def detect_tiled(model, img_paths, tile_size=640, overlap=0.2, max_side=None, iou_threshold=0.5, batch_size=8,
+                 num_workers=4, queue_depth=8):
+    """
+    分块推理：缩小解码 -> 重叠分块 -> 多张图片的分块合并成批推理 -> 跨分块 NMS 合并，
+    逐张产出 (路径, 原图坐标下的检测框数组)，无法读取的图片产出 (路径, None)
+    与 detect_batches 相同，同一批次只放相同尺寸的分块（小于 tile_size 的图片整张作为一个分块），结果与逐块推理一致；
+    分块是原图的视图，不额外复制像素；等待推理的分块数不超过 max(queue_depth, batch_size)，超出时先推理最大的一组
+    """
+    batch_size = max(1, batch_size)
+    max_buffered = max(queue_depth, batch_size)
+    buckets = OrderedDict()  # 分块尺寸 -> 待推理的分块 [(图片序号, x0, y0, 分块)]
+    buffered = 0
+    states = {}  # 图片序号 -> [路径, 缩小倍数, 剩余分块数, 检测框列表]
+
+    def run_batch(batch):
+        tiles = [tile for *_, tile in batch]
+        with metrics.stage("inference"):
+            results = model(tiles) if len(tiles) > 1 else model(tiles[0])
+        metrics.observe("batch_size", len(tiles), buckets=(1, 2, 4, 8, 16, 32, 64))
+        with metrics.stage("postprocess"):
+            tile_preds = [boxes_to_array(result) for result in results]
+        for (index, x0, y0, _), pred in zip(batch, tile_preds):
+            state = states[index]
+            if pred.size > 0:
+                pred = pred.copy()
+                pred[:, [0, 2]] += x0
+                pred[:, [1, 3]] += y0
+                state[3].append(pred)
+            state[2] -= 1
+            if state[2] == 0:
+                del states[index]
+                img_path, scale, _, preds = state
+                with metrics.stage("merge"):
+                    merged = nms(np.concatenate(preds), iou_threshold) if preds else np.zeros((0, 6), dtype=np.float32)
+                merged[:, :4] *= scale
+                yield img_path, merged
+
+    loader = lambda img_path: load_image(img_path, max_side)
+    images = prefetch_images(img_paths, num_workers=num_workers, queue_depth=queue_depth, loader=loader)
+    for index, (img_path, (img, scale)) in enumerate(images):
+        if img is None:
+            logger.warning("Error: Unable to load image %s", img_path)
+            metrics.count("images_unreadable")
+            yield img_path, None
+            continue
+
+        tiles = make_tiles(img.shape[0], img.shape[1], tile_size, overlap)
+        states[index] = [img_path, scale, len(tiles), []]
+        for x0, y0, x1, y1 in tiles:
+            tile = img[y0:y1, x0:x1]
+            batch = buckets.setdefault(tile.shape, [])
+            batch.append((index, x0, y0, tile))
+            buffered += 1
+            if len(batch) >= batch_size:
+                del buckets[tile.shape]
+                buffered -= len(batch)
+                yield from run_batch(batch)
+            elif buffered >= max_buffered:
+                # 缓冲的分块过多时，先推理最大的一组，控制内存占用
+                shape = max(buckets, key=lambda s: len(buckets[s]))
+                batch = buckets.pop(shape)
+                buffered -= len(batch)
+                yield from run_batch(batch)
+
+    for batch in buckets.values():
+        yield from run_batch(batch)
@@ -1,39 +1,56 @@
-import torch
-from ultralytics import YOLO
-import os
-os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
-
-def train(data_config, model_config, epochs=100, batch_size=16, learning_rate=0.001):
-    if not torch.cuda.is_available():
-        print("CUDA is not available. Using CPU.")
-        device = torch.device('cpu')
-    else:
-        print("CUDA is available. Using GPU.")
-        device = torch.device('cuda')
-        print(f"Device Name: {torch.cuda.get_device_name(0)}")
-        print(f"CUDA Version: {torch.version.cuda}")
-
-    print(f'Using device: {device}')
-
-
-    # 加载YOLO模型
-    model = YOLO(model_config).to(device)
-
-    # 训练模型，并指定保存路径和early stopping参数
-    # project：存储训练结果的路径
-    # name：保存的实验名称，包含学习率和轮次信息
-
-    # name = 'custom_experiment_8s_0902_' + str(learning_rate) + '_' + str(epochs)
-    name='custom_experiment_lian' + str(learning_rate) + '_' + str(epochs)
-
-    model.train(data=data_config, epochs=epochs, batch=batch_size, device=device, lr0=learning_rate,
-                project='runs/train',
-                name=name)
-
-
-if __name__ == "__main__":
-    data_config = './data/dataset.yaml'
-    model_config = './yolov8n.pt'
-    epochs = 200  # 设置训练的epoch数量
-    learning_rate = 0.001
-    train(data_config, model_config, epochs=epochs, learning_rate=learning_rate)
+import torch
+from ultralytics import YOLO
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
+
+def train(data_config, model_config, epochs=100, batch_size=16, learning_rate=0.001, export_format=None, name=None,
+          imgsz=640, project='runs/train', cache=False, callbacks=None, exist_ok=False, workers=8):
+    """
+    训练一个配置，返回训练结果目录（其中 results.csv 为逐轮指标，weights/best.pt 为最优权重）
+    name: 实验名称，默认由学习率和轮次生成
+    cache: 传给 Ultralytics 的数据缓存方式，"disk" 时解码后的图片保存为 .npy，后续训练直接复用
+    callbacks: {事件名: 回调函数}，如 {"on_fit_epoch_end": fn}，回调中设置 trainer.stop = True 可提前结束训练
+    workers: 数据加载进程数，同时运行多个训练时应相应减少
+    """
+    if not torch.cuda.is_available():
+        print("CUDA is not available. Using CPU.")
+        device = torch.device('cpu')
+    else:
+        print("CUDA is available. Using GPU.")
+        device = torch.device('cuda')
+        print(f"Device Name: {torch.cuda.get_device_name(0)}")
+        print(f"CUDA Version: {torch.version.cuda}")
+
+    print(f'Using device: {device}')
+
+
+    # 加载YOLO模型
+    model = YOLO(model_config).to(device)
+
+    # 训练模型，并指定保存路径和early stopping参数
+    # project：存储训练结果的路径
+    # name：保存的实验名称，包含学习率和轮次信息
+
+    # name = 'custom_experiment_8s_0902_' + str(learning_rate) + '_' + str(epochs)
+    if name is None:
+        name = 'custom_experiment_lian' + str(learning_rate) + '_' + str(epochs)
+
+    for event, callback in (callbacks or {}).items():
+        model.add_callback(event, callback)
+
+    model.train(data=data_config, epochs=epochs, batch=batch_size, device=device, lr0=learning_rate, imgsz=imgsz,
+                cache=cache, project=project, name=name, exist_ok=exist_ok, workers=workers)
+
+    # 训练结束后可将最优权重导出为 CPU 推理格式（如 "onnx"、"openvino"），供 evaluate_dataset 直接使用
+    if export_format:
+        best = YOLO(str(model.trainer.best))
+        print(f"Exported model: {best.export(format=export_format, dynamic=export_format == 'onnx')}")
+    return str(model.trainer.save_dir)
+
+
+if __name__ == "__main__":
+    data_config = './data/dataset.yaml'
+    model_config = './yolov8n.pt'
+    epochs = 200  # 设置训练的epoch数量
+    learning_rate = 0.001
+    train(data_config, model_config, epochs=epochs, learning_rate=learning_rate)